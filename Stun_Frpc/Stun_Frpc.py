@@ -1,13 +1,21 @@
 import dns.resolver
 import toml
+import tomllib
 import time
 import platform
 import subprocess
 import re
 import os
 import sys
+import copy
+import signal
+import select
+import selectors
+import socket
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging.handlers import MemoryHandler, RotatingFileHandler
 
 try:
     from dotenv import load_dotenv
@@ -23,6 +31,19 @@ CHECK_INTERVAL = int(os.getenv('STUN_CHECK_INTERVAL', '120'))  # 检查间隔(
 FRP_TOKEN = os.getenv('FRP_AUTH_TOKEN', 'stun_frp')  # FRP 认证 Token
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # 日志级别
 
+# 运行平台（platform.system() 无缓存，启动时判断一次）
+IS_WINDOWS = platform.system() == 'Windows'
+
+# 预编译 TXT 记录解析正则（bytes 模式，直接匹配 DNS 原始数据，省去 decode）
+# 分组: (client_local_port 编号, client_public_port 编号, 端口值)，均未命中编号时为 server_port
+TXT_PORT_RE = re.compile(rb'(?:server_port|client_local_port(\d+)|client_public_port(\d+))=(\d+)')
+
+# frpc 配置中随 DNS 变化的字段，更新时只替换所在行
+CONFIG_LINE_RES = {
+    key: re.compile(rf'^([ \t]*{key}[ \t]*=[ \t]*).*$', re.M)
+    for key in ('serverAddr', 'serverPort', 'remotePort')
+}
+
 # 获取脚本所在目录
 if getattr(sys, 'frozen', False):
     # 如果是打包后的可执行文件
@@ -43,6 +64,38 @@ FRPC_CONFIG_PATH = ''
 # 存储每个客户端的进程和端口信息
 frpc_processes = {}  # {client_number: process}
 frpc_connect_ports = {}  # {client_number: public_port}
+frpc_configs = {}  # {client_number: (mtime_ns, config)} 已解析的配置文件缓存
+frpc_config_ready = set()  # 配置文件已确认存在的客户端编号
+frpc_template = None  # 已解析的 frpc.toml 模板，生成各客户端配置时复用
+applied_configs = {}  # {client_number: ((server_port, remote_port, public_port), (config_path, local_ip, local_port))}
+
+# 退出事件，收到 SIGINT/SIGTERM 时置位
+stop_event = threading.Event()
+
+# 信号唤醒 socket：收到信号时由解释器写入一个字节，唤醒主循环中的 select
+wakeup_reader, wakeup_writer = socket.socketpair()
+wakeup_reader.setblocking(False)
+wakeup_writer.setblocking(False)
+
+# frpc 进程退出触发提前检查时，两次检查之间的最小间隔(秒)，避免崩溃循环时频繁重启
+CHILD_EXIT_MIN_INTERVAL = 10
+
+# DNS 解析器（每个 DNS 服务器一个，全局复用；解析结果由下方 txt_cache 按 TTL 缓存）
+DNS_NAMESERVERS = ['1.1.1.1', '8.8.8.8']
+dns_resolvers = []
+for nameserver in DNS_NAMESERVERS:
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [nameserver]
+    resolver.timeout = 5  # 5秒超时
+    resolver.lifetime = 10  # 总生存时间10秒
+    dns_resolvers.append(resolver)
+# 并发查询线程池，慢的查询在后台自然结束，不阻塞调用方
+dns_executor = ThreadPoolExecutor(max_workers=len(dns_resolvers), thread_name_prefix='DnsQuery')
+
+# TXT 记录解析结果缓存，在记录 TTL 内直接复用，不再发起查询
+TXT_CACHE_MIN_TTL = int(os.getenv('STUN_DNS_MIN_TTL', '30'))  # 最短缓存时间(秒)，避免过低的 TTL
+TXT_NEGATIVE_TTL = 60  # 域名不存在/无 TXT 记录时的缓存时间(秒)
+txt_cache = {'expires': 0.0, 'configs': {}}
 
 
 def setup_logger():
@@ -83,7 +136,14 @@ def setup_logger():
             )
             file_handler.setLevel(logging.DEBUG)
             file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            # 缓冲写入：每轮检查结束或出现 WARNING 以上日志时统一落盘
+            buffer_handler = MemoryHandler(
+                capacity=256,
+                flushLevel=logging.WARNING,
+                target=file_handler
+            )
+            buffer_handler.setLevel(logging.DEBUG)
+            logger.addHandler(buffer_handler)
             # 显示日志文件的绝对路径
             log_abs_path = os.path.abspath(LOG_FILE)
             logger.info(f"📝 日志文件已配置: {log_abs_path}")
@@ -96,6 +156,34 @@ def setup_logger():
 # 初始化日志
 logger = setup_logger()
 
+
+def flush_log():
+    """将缓冲中的日志写入文件"""
+    for handler in logger.handlers:
+        handler.flush()
+
+def resolve_txt(domain):
+    """
+    同时向所有 DNS 服务器查询 TXT 记录，返回最先成功的结果
+    
+    Args:
+        domain: 域名
+    
+    Returns:
+        dns.resolver.Answer: 最先成功返回的应答
+    
+    Raises:
+        所有服务器均查询失败时，抛出最后一个异常
+    """
+    futures = [dns_executor.submit(resolver.resolve, domain, 'TXT') for resolver in dns_resolvers]
+    error = None
+    for future in as_completed(futures):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
 def parse_txt_record(domain, max_retries=3, retry_delay=2):
     """
     解析 DNS TXT 记录，返回所有客户端的配置
@@ -108,47 +196,44 @@ def parse_txt_record(domain, max_retries=3, retry_delay=2):
     Returns:
         dict: {client_number: (server_port, remote_port, public_port)}
     """
+    # 缓存未过期时直接返回上次的解析结果
+    if time.monotonic() < txt_cache['expires']:
+        logger.debug("TXT 记录缓存未过期，跳过 DNS 查询")
+        return txt_cache['configs']
+    
     for retry in range(max_retries):
         try:
             if retry > 0:
                 logger.info(f"DNS 重试 {retry}/{max_retries-1}...")
                 time.sleep(retry_delay)
             
-            resolver = dns.resolver.Resolver()
-            resolver.cache = None  # 禁用缓存
-            resolver.nameservers = ['1.1.1.1', '8.8.8.8']
-            resolver.timeout = 5  # 5秒超时
-            resolver.lifetime = 10  # 总生存时间10秒
-            
-            answers = resolver.resolve(domain, 'TXT')
-            configs = {}  # {client_number: (server_port, remote_port, public_port)}
+            answers = resolve_txt(domain)
             server_port = None
+            local_ports = {}  # {client_number: client_local_port}
+            public_ports = {}  # {client_number: client_public_port}
             
+            # 单次扫描所有 TXT 字符串，按命中的分组分发
             for rdata in answers:
-                for txt_string in rdata.strings:
-                    txt = txt_string.decode()
-                    
-                    # 解析 server_port（所有客户端共用）
-                    if server_port is None:
-                        server_match = re.search(r'server_port=(\d+)', txt)
-                        if server_match:
-                            server_port = int(server_match.group(1))
-                    
-                    # 解析每个客户端的配置
-                    for client_num in CLIENT_NUMBERS:
-                        local_port_key = f'client_local_port{client_num}'
-                        public_port_key = f'client_public_port{client_num}'
-                        
-                        # 解析 client_local_port (frpc remotePort)
-                        local_match = re.search(rf'{local_port_key}=(\d+)', txt)
-                        # 解析 client_public_port (公网连接端口)
-                        public_match = re.search(rf'{public_port_key}=(\d+)', txt)
-                        
-                        if local_match and public_match:
-                            remote_port = int(local_match.group(1))
-                            public_port = int(public_match.group(1))
-                            configs[client_num] = (server_port, remote_port, public_port)
-                            logger.debug(f"客户端{client_num}: server_port={server_port}, {local_port_key}={remote_port}, {public_port_key}={public_port}")
+                for txt in rdata.strings:
+                    for match in TXT_PORT_RE.finditer(txt):
+                        local_num, public_num, value = match.groups()
+                        if local_num is not None:
+                            # client_local_port (frpc remotePort)
+                            local_ports.setdefault(int(local_num), int(value))
+                        elif public_num is not None:
+                            # client_public_port (公网连接端口)
+                            public_ports.setdefault(int(public_num), int(value))
+                        elif server_port is None:
+                            # server_port（所有客户端共用）
+                            server_port = int(value)
+            
+            configs = {}  # {client_number: (server_port, remote_port, public_port)}
+            for client_num in CLIENT_NUMBERS:
+                if client_num in local_ports and client_num in public_ports:
+                    remote_port = local_ports[client_num]
+                    public_port = public_ports[client_num]
+                    configs[client_num] = (server_port, remote_port, public_port)
+                    logger.debug(f"客户端{client_num}: server_port={server_port}, client_local_port{client_num}={remote_port}, client_public_port{client_num}={public_port}")
             
             # 检查是否所有请求的客户端都找到了配置
             missing_clients = [num for num in CLIENT_NUMBERS if num not in configs]
@@ -157,15 +242,21 @@ def parse_txt_record(domain, max_retries=3, retry_delay=2):
             
             if configs:
                 logger.info(f"✅ 成功解析 {len(configs)}/{len(CLIENT_NUMBERS)} 个客户端配置")
+                txt_cache['configs'] = configs
+                txt_cache['expires'] = time.monotonic() + max(answers.rrset.ttl, TXT_CACHE_MIN_TTL)
                 return configs
             else:
                 logger.warning(f"⚠️ 未解析到任何客户端配置，将重试...")
                 
         except dns.resolver.NXDOMAIN:
             logger.error(f"域名 {domain} 不存在")
+            txt_cache['configs'] = {}
+            txt_cache['expires'] = time.monotonic() + TXT_NEGATIVE_TTL
             return {}
         except dns.resolver.NoAnswer:
             logger.error(f"域名 {domain} 没有 TXT 记录")
+            txt_cache['configs'] = {}
+            txt_cache['expires'] = time.monotonic() + TXT_NEGATIVE_TTL
             return {}
         except dns.resolver.Timeout:
             logger.warning(f"⚠️ DNS 查询超时 (尝试 {retry+1}/{max_retries})")
@@ -177,35 +268,107 @@ def parse_txt_record(domain, max_retries=3, retry_delay=2):
     logger.error(f"❌ DNS 查询失败，已重试 {max_retries} 次")
     return {}
 
+def load_frpc_template():
+    """读取 frpc.toml 模板（只解析一次，生成各客户端配置时复用）"""
+    global frpc_template
+    if frpc_template is None:
+        with open(FRPC_CONFIG_PATH, 'rb') as f:
+            frpc_template = tomllib.load(f)
+    return frpc_template
+
+def write_file_atomic(path, content):
+    """
+    原子写入文件：先写临时文件并落盘，再通过 os.replace 替换，避免 frpc 读到不完整的配置
+    
+    Args:
+        path: 目标文件路径
+        content: 文件内容
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def patch_config_lines(config_path, updates):
+    """
+    按行替换配置文件中的指定字段，并通过临时文件原子写回
+    
+    Args:
+        config_path: 配置文件路径
+        updates: {字段名: 新值}，字段名需在 CONFIG_LINE_RES 中
+    
+    Returns:
+        bool: 是否替换成功（任一字段未找到时不写入文件）
+    """
+    if not updates:
+        return True
+    
+    with open(config_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    
+    for key, value in updates.items():
+        literal = f'"{value}"' if isinstance(value, str) else str(value)
+        content, count = CONFIG_LINE_RES[key].subn(lambda m: m.group(1) + literal, content, count=1)
+        if not count:
+            return False
+    
+    write_file_atomic(config_path, content)
+    return True
+
 def update_frpc_config(client_number, server_port, remote_port, public_port):
-    """更新指定客户端的 frpc 配置文件"""
+    """
+    更新指定客户端的 frpc 配置文件
+    
+    Returns:
+        tuple: (是否变化, 配置文件路径, localIP, localPort, 内存中的配置)
+               跳过读取配置文件时内存配置为 None，启动前需从文件验证
+    """
     global frpc_connect_ports
+    # DNS 下发的端口与上次成功应用的一致，无需读写配置文件
+    ports = (server_port, remote_port, public_port)
+    applied = applied_configs.get(client_number)
+    if applied and applied[0] == ports:
+        return (False,) + applied[1] + (None,)
+    
     try:
         # 为每个客户端使用独立的配置文件
-        base_dir = os.path.dirname(FRPC_CONFIG_PATH)
-        config_path = os.path.join(base_dir, f'frpc_{client_number}.toml')
-        
-        # 如果配置文件不存在，从模板复制
-        if not os.path.exists(config_path):
-            if os.path.exists(FRPC_CONFIG_PATH):
-                import shutil
-                shutil.copy(FRPC_CONFIG_PATH, config_path)
-                logger.info(f"📝 为客户端{client_number}创建配置文件: {config_path}")
+        config_path = CLIENT_CONFIG_PATHS[client_number]
         
-        config = toml.load(config_path)
+        # 如果配置文件不存在，从缓存的模板生成（确认存在后不再重复检查）
+        created = client_number not in frpc_config_ready and not os.path.exists(config_path)
+        if created:
+            config = copy.deepcopy(load_frpc_template())
+            logger.info(f"📝 为客户端{client_number}创建配置文件: {config_path}")
+        else:
+            frpc_config_ready.add(client_number)
+            # 优先使用内存中的配置，文件被手动修改过(mtime 变化)时才重新解析
+            mtime_ns = os.stat(config_path).st_mtime_ns
+            cached = frpc_configs.get(client_number)
+            if cached and cached[0] == mtime_ns:
+                config = cached[1]
+            else:
+                with open(config_path, 'rb') as f:
+                    config = tomllib.load(f)
+                frpc_configs[client_number] = (mtime_ns, config)
         
-        changed = False
+        changed = created
+        line_updates = {}  # 只需替换单行的字段 {key: value}
+        full_rewrite = created  # 是否需要完整重写配置文件
         
         # 更新 serverPort
         old_server = config.get('serverPort')
         if old_server != server_port:
             config['serverPort'] = server_port
+            line_updates['serverPort'] = server_port
             changed = True
         
         # 更新 serverAddr
         old_addr = config.get('serverAddr')
         if old_addr != DOMAIN:
             config['serverAddr'] = DOMAIN
+            line_updates['serverAddr'] = DOMAIN
             changed = True
 
         # 更新 auth.token (如果环境变量中配置了)
@@ -218,6 +381,7 @@ def update_frpc_config(client_number, server_port, remote_port, public_port):
                 config['auth']['method'] = 'token'
                 config['auth']['token'] = FRP_TOKEN
                 changed = True
+                full_rewrite = True
                 logger.info(f"⚙️  客户端{client_number} auth.token 已更新")
 
         # 获取当前代理配置
@@ -234,6 +398,7 @@ def update_frpc_config(client_number, server_port, remote_port, public_port):
                 base_name = re.sub(r'_client\d+$', '', original_name)
                 proxy['name'] = f'{base_name}_client{client_number}'
                 changed = True
+                full_rewrite = True
                 logger.info(f"⚙️  客户端{client_number}代理名称更新为: {proxy['name']}")
             
             old_remote_port = proxy.get('remotePort')
@@ -244,6 +409,7 @@ def update_frpc_config(client_number, server_port, remote_port, public_port):
             # 更新代理远程下发端口（对应 client_local_port）
             if old_remote_port != remote_port:
                 proxy['remotePort'] = remote_port
+                line_updates['remotePort'] = remote_port
                 changed = True
         
         # 更新公网连接端口（对应 client_public_port）
@@ -252,16 +418,24 @@ def update_frpc_config(client_number, server_port, remote_port, public_port):
             changed = True
 
         if not changed:
-            return False, config_path, local_ip, local_port  # 无变化
+            applied_configs[client_number] = (ports, (config_path, local_ip, local_port))
+            return False, config_path, local_ip, local_port, config  # 无变化
 
-        with open(config_path, 'w') as f:
-            toml.dump(config, f)
+        # 仅少数字段变化时按行替换，保留文件原有格式；否则完整重写
+        if full_rewrite or not patch_config_lines(config_path, line_updates):
+            write_file_atomic(config_path, toml.dumps(config))
+        frpc_configs[client_number] = (os.stat(config_path).st_mtime_ns, config)
+        frpc_config_ready.add(client_number)
+        applied_configs[client_number] = (ports, (config_path, local_ip, local_port))
 
         logger.info(f"📋 客户端{client_number}: serverAddr={DOMAIN}, serverPort={server_port}, remotePort={remote_port}, 公网端口={public_port}")
-        return True, config_path, local_ip, local_port
+        return True, config_path, local_ip, local_port, config
     except Exception as e:
         logger.error(f"❌ 更新客户端{client_number}配置文件失败: {e}")
-        return False, None, None, None
+        # 内存中的配置可能已被修改但未写入，丢弃缓存；下次重新检查配置文件是否存在
+        frpc_configs.pop(client_number, None)
+        frpc_config_ready.discard(client_number)
+        return False, None, None, None, None
 
 def validate_config(config_path):
     """
@@ -274,8 +448,24 @@ def validate_config(config_path):
         bool: 配置是否有效
     """
     try:
-        config = toml.load(config_path)
-        
+        with open(config_path, 'rb') as f:
+            config = tomllib.load(f)
+    except Exception as e:
+        logger.error(f"❌ 配置文件验证失败: {e}")
+        return False
+    return validate_config_dict(config)
+
+def validate_config_dict(config):
+    """
+    验证已解析的 frpc 配置是否有效
+    
+    Args:
+        config: 配置字典
+    
+    Returns:
+        bool: 配置是否有效
+    """
+    try:
         # 检查必需的字段
         required_fields = ['serverAddr', 'serverPort']
         for field in required_fields:
@@ -327,92 +517,160 @@ def check_process_health(client_number):
 
 def get_frpc_paths():
     """获取 frpc 可执行文件和配置文件路径，支持 PyInstaller 打包"""
-    system = platform.system()
-    
-    # 判断是否为 PyInstaller 打包后的可执行文件
-    if getattr(sys, 'frozen', False):
-        # 如果是打包后的可执行文件，使用可执行文件所在目录
-        base_dir = os.path.dirname(sys.executable)
-    else:
-        # 如果是源码运行，使用脚本所在目录
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    if system == 'Windows':
-        exe = os.path.join(base_dir, 'Windows', 'frpc.exe')
-        conf = os.path.join(base_dir, 'Windows', 'frpc.toml')
+    if IS_WINDOWS:
+        exe = os.path.join(SCRIPT_DIR, 'Windows', 'frpc.exe')
+        conf = os.path.join(SCRIPT_DIR, 'Windows', 'frpc.toml')
     else:
-        exe = os.path.join(base_dir, 'Linux', 'frpc')
-        conf = os.path.join(base_dir, 'Linux', 'frpc.toml')
+        exe = os.path.join(SCRIPT_DIR, 'Linux', 'frpc')
+        conf = os.path.join(SCRIPT_DIR, 'Linux', 'frpc.toml')
     return exe, conf
 
 FRPC_EXE_PATH, FRPC_CONFIG_PATH = get_frpc_paths()
 
+# 每个客户端独立的配置文件路径 {client_number: config_path}
+CLIENT_CONFIG_PATHS = {
+    num: os.path.join(os.path.dirname(FRPC_CONFIG_PATH), f'frpc_{num}.toml')
+    for num in CLIENT_NUMBERS
+}
 
-def safe_terminate_process(process, process_name="进程", timeout_terminate=5, timeout_kill=2):
+# Windows: 为 frpc 创建新的进程组，便于单独发送 CTRL_BREAK_EVENT
+POPEN_CREATION_FLAGS = subprocess.CREATE_NEW_PROCESS_GROUP if IS_WINDOWS else 0
+
+
+def wait_process_exit(process, timeout):
     """
-    安全地终止进程，先尝试 terminate，超时后使用 kill
+    等待进程退出，最多等待 timeout 秒，进程退出时立即返回
+    Linux 上通过 pidfd 阻塞等待，不支持时回退到 Popen.wait
     
     Args:
         process: subprocess.Popen 对象
-        process_name: 进程名称（用于日志）
+        timeout: 最长等待时间（秒）
+    
+    Returns:
+        bool: 进程是否已退出
+    """
+    if process.poll() is not None:
+        return True
+    
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            pidfd = None  # 内核不支持 pidfd (Linux < 5.3)
+        if pidfd is not None:
+            try:
+                poller = select.poll()
+                poller.register(pidfd, select.POLLIN)
+                poller.poll(timeout * 1000)
+            finally:
+                os.close(pidfd)
+            return process.poll() is not None
+    
+    try:
+        process.wait(timeout=timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        return False
+
+
+def terminate_processes(processes, timeout_terminate=5, timeout_kill=2):
+    """
+    批量终止多个进程：先全部发送 terminate，再共享同一截止时间等待，超时的统一 kill
+    
+    Args:
+        processes: {进程名称: subprocess.Popen 对象}
         timeout_terminate: terminate 等待超时时间（秒）
         timeout_kill: kill 等待超时时间（秒）
     
     Returns:
-        bool: 是否成功终止
+        dict: {进程名称: 是否成功终止}
     """
-    if not process or process.poll() is not None:
-        return True  # 进程已经退出
+    results = {}
+    pending = {}
+    stragglers = {}  # 已发送 kill、等待退出的进程
     
-    try:
-        logger.info(f"🛑 正在终止 {process_name} (PID: {process.pid})...")
-        process.terminate()
+    # 1. 向所有存活进程发送 terminate
+    for process_name, process in processes.items():
+        if not process or process.poll() is not None:
+            results[process_name] = True  # 进程已经退出
+            continue
+        try:
+            logger.info(f"🛑 正在终止 {process_name} (PID: {process.pid})...")
+            if IS_WINDOWS:
+                # Windows: terminate 等同于强制结束，改为发送 CTRL_BREAK_EVENT 让 frpc 正常退出
+                try:
+                    process.send_signal(signal.CTRL_BREAK_EVENT)
+                except OSError as e:
+                    # 无控制台运行（pythonw、服务、计划任务）时无法发送控制台事件，直接 kill 并等待其退出
+                    logger.warning(f"⚠️ 无法向 {process_name} 发送 CTRL_BREAK_EVENT ({e})，使用 kill 强制结束...")
+                    process.kill()
+                    stragglers[process_name] = process
+                    continue
+            else:
+                process.terminate()
+            pending[process_name] = process
+        except Exception as e:
+            logger.error(f"❌ 终止 {process_name} 失败: {e}")
+            results[process_name] = False
+    
+    # 2. 共享截止时间等待退出，超时的进程使用 kill
+    deadline = time.monotonic() + timeout_terminate
+    for process_name, process in pending.items():
         try:
-            process.wait(timeout=timeout_terminate)
+            process.wait(timeout=max(0, deadline - time.monotonic()))
             logger.info(f"✅ {process_name} 已正常终止")
-            return True
+            results[process_name] = True
         except subprocess.TimeoutExpired:
             logger.warning(f"⚠️ {process_name} 未响应 terminate，使用 kill 强制结束...")
-            process.kill()
             try:
-                process.wait(timeout=timeout_kill)
-                logger.warning(f"✅ {process_name} 已强制结束")
-                return True
-            except:
-                logger.error(f"❌ {process_name} 可能未完全结束")
-                return False
-    except Exception as e:
-        logger.error(f"❌ 终止 {process_name} 失败: {e}")
-        return False
+                process.kill()
+                stragglers[process_name] = process
+            except Exception as e:
+                logger.error(f"❌ 终止 {process_name} 失败: {e}")
+                results[process_name] = False
+    
+    # 3. 共享截止时间等待被 kill 的进程
+    deadline = time.monotonic() + timeout_kill
+    for process_name, process in stragglers.items():
+        try:
+            process.wait(timeout=max(0, deadline - time.monotonic()))
+            logger.warning(f"✅ {process_name} 已强制结束")
+            results[process_name] = True
+        except subprocess.TimeoutExpired:
+            logger.error(f"❌ {process_name} 可能未完全结束")
+            results[process_name] = False
+    
+    return results
 
 
-def start_frpc(client_number, config_path):
-    """启动指定客户端的 frpc 进程"""
+def start_frpc(client_number, config_path, config=None):
+    """
+    启动指定客户端的 frpc 进程
+    
+    Args:
+        client_number: 客户端编号
+        config_path: 配置文件路径
+        config: 刚写入文件的内存配置，提供时直接验证，无需重新解析配置文件
+    """
     global frpc_processes
     try:
-        # 验证配置文件
-        if not validate_config(config_path):
+        # 验证配置
+        valid = validate_config_dict(config) if config is not None else validate_config(config_path)
+        if not valid:
             logger.error(f"❌ 客户端{client_number}配置文件验证失败")
             return False
         
-        # Windows 上不使用 shell=True，避免子进程无法终止
-        if platform.system() == 'Windows':
-            # Windows: 创建新的进程组，便于终止
-            CREATE_NEW_PROCESS_GROUP = 0x00000200
-            process = subprocess.Popen(
-                [FRPC_EXE_PATH, '-c', config_path],
-                creationflags=CREATE_NEW_PROCESS_GROUP
-            )
-        else:
-            # Linux/Unix: 直接启动
-            process = subprocess.Popen([FRPC_EXE_PATH, '-c', config_path])
+        # 不使用 shell=True，直接启动可执行文件，信号直达 frpc 本身
+        process = subprocess.Popen(
+            [FRPC_EXE_PATH, '-c', config_path],
+            creationflags=POPEN_CREATION_FLAGS
+        )
         
         frpc_processes[client_number] = process
         logger.info(f"✅ 客户端{client_number} frpc 已启动 (PID: {process.pid})")
         
-        # 短暂等待，检查进程是否立即退出
-        time.sleep(0.5)
-        if process.poll() is not None:
+        # 短暂等待，检查进程是否立即退出（进程退出时立即返回）
+        if wait_process_exit(process, 0.5):
             logger.error(f"❌ 客户端{client_number} frpc 启动后立即退出 (返回码: {process.returncode})")
             del frpc_processes[client_number]
             return False
@@ -422,42 +680,107 @@ def start_frpc(client_number, config_path):
         logger.error(f"❌ 启动客户端{client_number} frpc 失败: {e}", exc_info=True)
         return False
 
-def restart_frpc(client_number, config_path):
-    """重启指定客户端的 frpc 进程"""
+def restart_frpcs(targets):
+    """
+    并行重启多个客户端的 frpc 进程
+    先批量终止所有旧进程，统一等待一次服务器释放代理连接，再并行启动新进程
+    
+    Args:
+        targets: {client_number: (config_path, config)}，config 为 None 时从文件验证
+    
+    Returns:
+        dict: {client_number: 是否重启成功}
+    """
     global frpc_processes
+    results = {client_number: False for client_number in targets}
     try:
-        # 检查进程是否存在且正在运行
-        if client_number in frpc_processes:
-            process = frpc_processes[client_number]
+        # 1. 批量终止仍在运行的旧进程
+        had_process = False
+        old_processes = {}  # {进程名称: process}
+        for client_number in targets:
+            process = frpc_processes.pop(client_number, None)
+            if process is None:
+                continue
+            had_process = True
             if process.poll() is None:
                 logger.info(f"🛑 正在终止客户端{client_number} frpc 进程...")
-                if not safe_terminate_process(process, f"客户端{client_number} frpc", timeout_terminate=5, timeout_kill=2):
-                    logger.warning(f"⚠️ 客户端{client_number} frpc 可能未完全关闭，但仍继续重启流程")
+                old_processes[f"客户端{client_number} frpc"] = process
             else:
                 logger.info(f"✅ 客户端{client_number} frpc 进程已不在运行")
-            
-            # 清理进程记录
-            del frpc_processes[client_number]
-            
-            # 等待服务器端完全释放代理连接
+        
+        for process_name, terminated in terminate_processes(old_processes, 5, 2).items():
+            if not terminated:
+                logger.warning(f"⚠️ {process_name} 可能未完全关闭，但仍继续重启流程")
+        
+        # 2. 等待服务器端完全释放代理连接（所有客户端只等待一次）
+        if had_process:
             logger.debug("等待服务器释放代理连接...")
             time.sleep(3)
         
-        # 启动新进程
-        if start_frpc(client_number, config_path):
-            logger.info(f"✅ 客户端{client_number} frpc 重启完成")
-            return True
-        else:
-            logger.error(f"❌ 客户端{client_number} frpc 重启失败")
-            return False
+        with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+            # 3. 并行启动新进程
+            starts = {
+                client_number: executor.submit(start_frpc, client_number, config_path, config)
+                for client_number, (config_path, config) in targets.items()
+            }
+            for client_number, future in starts.items():
+                results[client_number] = future.result()
+                if results[client_number]:
+                    logger.info(f"✅ 客户端{client_number} frpc 重启完成")
+                else:
+                    logger.error(f"❌ 客户端{client_number} frpc 重启失败")
     except Exception as e:
-        logger.error(f"❌ 重启客户端{client_number} frpc 失败: {e}", exc_info=True)
-        # 确保清理进程记录
-        if client_number in frpc_processes:
-            del frpc_processes[client_number]
-        return False
+        logger.error(f"❌ 重启客户端 frpc 失败: {e}", exc_info=True)
+    return results
+
+def handle_stop_signal(signum, frame):
+    """退出信号处理：置位退出事件，由主循环负责清理"""
+    stop_event.set()
+
+def wait_for_events(timeout):
+    """
+    阻塞等待，直到超时、收到信号或有 frpc 进程退出
+    Linux 上通过 pidfd 感知进程退出，其他平台只在超时或收到信号时返回
+    
+    Args:
+        timeout: 最长等待时间（秒）
+    
+    Returns:
+        bool: 是否有 frpc 进程退出
+    """
+    pidfds = []
+    with selectors.DefaultSelector() as selector:
+        selector.register(wakeup_reader, selectors.EVENT_READ)
+        if hasattr(os, 'pidfd_open'):
+            for process in frpc_processes.values():
+                if process.poll() is not None:
+                    continue  # 已退出的进程由健康检查处理
+                try:
+                    pidfd = os.pidfd_open(process.pid)
+                except OSError:
+                    continue
+                pidfds.append(pidfd)
+                selector.register(pidfd, selectors.EVENT_READ)
+        try:
+            events = selector.select(max(timeout, 0))
+        finally:
+            for pidfd in pidfds:
+                os.close(pidfd)
+    
+    # 清空信号唤醒数据
+    try:
+        while wakeup_reader.recv(64):
+            pass
+    except OSError:
+        pass
+    
+    return any(key.fileobj is not wakeup_reader for key, _ in events)
 
 def main():
+    signal.signal(signal.SIGINT, handle_stop_signal)
+    signal.signal(signal.SIGTERM, handle_stop_signal)
+    signal.set_wakeup_fd(wakeup_writer.fileno())
+    
     logger.info("")
     logger.info("="*70)
     logger.info("🌟 Stun_Frpc 服务启动")
@@ -476,20 +799,38 @@ def main():
     for client_num in CLIENT_NUMBERS:
         if client_num in configs:
             server_port, remote_port, public_port = configs[client_num]
-            changed, config_path, local_ip, local_port = update_frpc_config(client_num, server_port, remote_port, public_port)
+            changed, config_path, local_ip, local_port, config = update_frpc_config(client_num, server_port, remote_port, public_port)
             if config_path:
                 logger.info(f"✅ 客户端{client_num}连接地址: {DOMAIN}:{public_port}")
                 if local_ip and local_port:
                     logger.info(f"   └─ 目标地址: {local_ip}:{local_port}")
-                if not start_frpc(client_num, config_path):
+                if not start_frpc(client_num, config_path, config):
                     logger.warning(f"❌ 客户端{client_num}启动失败，将在下次检查时继续尝试")
         else:
             logger.warning(f"⚠️ 跳过客户端{client_num}的启动，未找到配置")
     
-    # 进入监控循环
+    # 进入监控循环：检查时间到达、frpc 进程退出或收到退出信号时唤醒
+    last_check = time.monotonic()
+    next_check = last_check + CHECK_INTERVAL
     while True:
         try:
-            time.sleep(CHECK_INTERVAL)
+            flush_log()
+            child_exited = wait_for_events(next_check - time.monotonic())
+            if stop_event.is_set():
+                logger.info("")
+                logger.info("⚠️ 接收到退出信号...")
+                break
+            
+            if child_exited:
+                # 有进程退出时提前检查，但与上次检查保持最小间隔
+                logger.info("")
+                logger.info("🔔 检测到 frpc 进程退出，提前检查...")
+                next_check = min(next_check, last_check + CHILD_EXIT_MIN_INTERVAL)
+            if time.monotonic() < next_check:
+                continue
+            last_check = time.monotonic()
+            next_check = last_check + CHECK_INTERVAL
+            
             logger.info("")
             logger.info("🔄 定期检查端口配置...")
             
@@ -510,33 +851,33 @@ def main():
                 logger.warning("⚠️ DNS 查询失败，跳过本次检查")
                 continue
             
-            # 检查每个客户端的配置
+            # 检查每个客户端的配置，收集需要重启的客户端
+            restart_targets = {}  # {client_num: (config_path, config, public_port, local_ip, local_port)}
             for client_num in CLIENT_NUMBERS:
                 if client_num in configs:
                     server_port, remote_port, public_port = configs[client_num]
-                    changed, config_path, local_ip, local_port = update_frpc_config(client_num, server_port, remote_port, public_port)
+                    changed, config_path, local_ip, local_port, config = update_frpc_config(client_num, server_port, remote_port, public_port)
                     
                     # 如果进程已死亡或配置改变，需要重启
-                    if client_num in dead_clients or (changed and config_path):
+                    if config_path and (client_num in dead_clients or changed):
                         if client_num in dead_clients:
                             logger.warning(f"⚠️ 客户端{client_num}进程异常，尝试重启...")
-                            if start_frpc(client_num, config_path):
-                                logger.info(f"✅ 客户端{client_num}连接地址: {DOMAIN}:{public_port}")
-                                if local_ip and local_port:
-                                    logger.info(f"   └─ 目标地址: {local_ip}:{local_port}")
-                            else:
-                                logger.warning(f"❌ 客户端{client_num}重启失败，将在下次检查时继续尝试")
-                        else:
-                            if restart_frpc(client_num, config_path):
-                                logger.info(f"✅ 客户端{client_num}连接地址: {DOMAIN}:{public_port}")
-                                if local_ip and local_port:
-                                    logger.info(f"   └─ 目标地址: {local_ip}:{local_port}")
-                            else:
-                                logger.warning(f"❌ 客户端{client_num}重启失败，将在下次检查时继续尝试")
+                        restart_targets[client_num] = (config_path, config, public_port, local_ip, local_port)
                     elif not changed:
                         logger.info(f"✅ 客户端{client_num}配置未改变，无需重启")
                 else:
                     logger.warning(f"⚠️ 客户端{client_num}未能从 TXT 记录中解析端口，保持当前配置")
+            
+            # 并行重启所有需要重启的客户端
+            if restart_targets:
+                results = restart_frpcs({num: target[:2] for num, target in restart_targets.items()})
+                for client_num, (config_path, config, public_port, local_ip, local_port) in restart_targets.items():
+                    if results[client_num]:
+                        logger.info(f"✅ 客户端{client_num}连接地址: {DOMAIN}:{public_port}")
+                        if local_ip and local_port:
+                            logger.info(f"   └─ 目标地址: {local_ip}:{local_port}")
+                    else:
+                        logger.warning(f"❌ 客户端{client_num}重启失败，将在下次检查时继续尝试")
                     
         except KeyboardInterrupt:
             logger.info("")
@@ -545,21 +886,20 @@ def main():
         except Exception as e:
             logger.error(f"主循环异常: {e}", exc_info=True)
             logger.info("⏱️ 等待下次检查...")
-            time.sleep(60)
+            next_check = time.monotonic() + 60
     
     # 清理资源
     logger.info("")
     logger.info("🧹 清理资源...")
-    for client_num, process in list(frpc_processes.items()):
-        if process and process.poll() is None:
-            logger.info(f"🛑 停止客户端{client_num} frpc...")
-            safe_terminate_process(process, f"客户端{client_num} frpc", timeout_terminate=5, timeout_kill=2)
+    # 批量终止所有客户端，总耗时取决于最慢的一个
+    terminate_processes({f"客户端{num} frpc": p for num, p in frpc_processes.items()}, 5, 2)
     
     logger.info("")
     logger.info("="*70)
     logger.info("👋 服务已停止")
     logger.info("="*70)
     logger.info("")
+    flush_log()
 
 
 if __name__ == '__main__':
@@ -1,15 +1,26 @@
 import toml
+import tomllib
 import subprocess
 import platform
 import os
 import sys
 import time
 import re
+import json
+import random
+import socket
 import requests
 import logging
 import threading
+import selectors
+import signal
+import queue
+import atexit
 import dns.resolver
-from logging.handlers import RotatingFileHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 try:
     from dotenv import load_dotenv
@@ -25,6 +36,27 @@ CHECK_INTERVAL = int(os.getenv('STUN_CHECK_INTERVAL', '300'))  # 定期检查间
 FRP_TOKEN = os.getenv('FRP_AUTH_TOKEN', 'stun_frp')  # FRP 认证 Token
 LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()  # 日志级别
 
+IS_WINDOWS = platform.system() == 'Windows'
+
+# natter 映射地址输出，格式: "tcp://内网IP:内网端口 <--Natter--> tcp://公网IP:公网端口"
+# natter 输出以字节读取，只对包含 NATTER_MARK 的行做正则匹配
+NATTER_MARK = b'<--Natter-->'
+NATTER_RE = re.compile(rb'tcp://([0-9.]+):(\d+)\s+<--Natter-->\s+tcp://([0-9.]+):(\d+)')
+# DNS TXT 记录中的端口映射字段
+TXT_SERVER_PORT_RE = re.compile(r'server_port=(\d+)')
+TXT_LOCAL_PORT_RE = re.compile(r'client_local_(port\d+)=(\d+)')
+TXT_PUBLIC_PORT_RE = re.compile(r'client_public_(port\d+)=(\d+)')
+# Stun_Port.toml 中合法的端口名称（字母、数字和下划线）
+PORT_NAME_RE = re.compile(r'[A-Za-z0-9_]+')
+
+# natter 打洞重试：指数退避并加入随机抖动，避免多个端口同时重试
+NATTER_MAX_RETRIES = 3  # 最大尝试次数
+NATTER_RETRY_BASE_DELAY = 0.5  # 首次重试前的基础等待时间（秒），之后每次翻倍
+NATTER_RETRY_MAX_DELAY = 10  # 重试等待时间上限（秒）
+
+# frps.toml 中的 bindPort 行，更新端口时按行替换以保留文件原有格式
+BIND_PORT_RE = re.compile(r'^([ \t]*bindPort[ \t]*=[ \t]*)\d+', re.M)
+
 # 路径配置
 # 判断是否为 PyInstaller 打包后的可执行文件
 if getattr(sys, 'frozen', False):
@@ -40,11 +72,12 @@ if not os.path.isabs(LOG_FILE):
     LOG_FILE = os.path.join(BASE_DIR, LOG_FILE)
 
 STUN_PORT_CONFIG = os.path.join(BASE_DIR, 'Stun_Port.toml')
+CLOUDFLARE_CACHE_FILE = os.path.join(BASE_DIR, 'cloudflare_cache.json')  # Zone ID 和记录 ID 缓存
 
 # Natter 路径：根据是否打包和操作系统选择
 if getattr(sys, 'frozen', False):
     # 打包后：使用编译的可执行文件
-    if platform.system() == 'Windows':
+    if IS_WINDOWS:
         NATTER_PATH = os.path.join(BASE_DIR, 'Natter', 'natter.exe')
     else:
         NATTER_PATH = os.path.join(BASE_DIR, 'Natter', 'natter')
@@ -58,8 +91,46 @@ FRPS_CONFIG_PATH = ''
 
 # 全局变量
 frps_process = None
+frps_bind_port = None  # 当前 frps 进程启动时使用的 bindPort，重启前等待该端口释放
+frps_config_applied = None  # 最近一次确认写入 frps.toml 的状态 (mtime_ns, bindPort, token)
 natter_processes = {}  # 存储每个端口对应的natter进程
+natter_lock = threading.Lock()  # 并行重启时保护 natter_processes 的增删和遍历
+# 定期检查中的 DNS 同步在后台单线程中执行，主循环不等待 Cloudflare 响应
+# 仅一个工作线程，提交的记录更新天然串行；启动时的直接更新发生在任何提交之前
+cloudflare_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Cloudflare')
+natter_event = threading.Event()  # natter 进程退出或映射地址变化时由输出监听线程置位，唤醒主循环
+stun_port_config_cache = None  # Stun_Port.toml 解析结果缓存 (mtime_ns, port_config)
 zone_id = None  # Cloudflare Zone ID 缓存
+dns_record_ids = None  # Cloudflare A/TXT 记录 ID 缓存 {'A': id, 'TXT': id}
+record_contents = {}  # Cloudflare 上记录的已知内容（最近一次推送或查询到的） {'A': content, 'TXT': content}
+NATTER_EXIT_MIN_INTERVAL = 10  # natter 退出或映射变化触发提前检查时，与上次检查的最小间隔（秒）
+CHECK_INTERVAL_MAX = CHECK_INTERVAL * 10  # 持续正常时检查间隔逐次翻倍的上限（秒）
+DNS_VERIFY_INTERVAL = 1800  # 内存与最近推送一致时，仍查询 DNS 校验的最长间隔（秒）
+dns_verified_at = None  # 最近一次确认 DNS 与内存一致（或推送成功）的时间 (monotonic)
+
+# DNS 解析器（每个 DNS 服务器一个，全局复用；不使用缓存，每次获取最新记录）
+DNS_NAMESERVERS = ['1.1.1.1', '8.8.8.8']  # 使用 Cloudflare 和 Google DNS
+dns_resolvers = []
+for nameserver in DNS_NAMESERVERS:
+    resolver = dns.resolver.Resolver(configure=False)
+    resolver.nameservers = [nameserver]
+    resolver.timeout = 5  # 5秒超时
+    resolver.lifetime = 10  # 总生存时间10秒
+    dns_resolvers.append(resolver)
+# 并发查询线程池，慢的查询在后台自然结束，不阻塞调用方
+dns_executor = ThreadPoolExecutor(max_workers=len(dns_resolvers), thread_name_prefix='DnsQuery')
+
+# Cloudflare API 会话：复用 TCP/TLS 连接，并对限流和服务端错误自动退避重试
+cloudflare_session = requests.Session()
+cloudflare_session.headers.update({
+    'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
+    'Content-Type': 'application/json'
+})
+cloudflare_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=4,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+))
 
 
 def setup_logger():
@@ -81,9 +152,10 @@ def setup_logger():
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
     
     # 文件输出（如果配置了）
+    file_error = None
     if LOG_FILE:
         try:
             # 确保日志目录存在
@@ -96,16 +168,30 @@ def setup_logger():
                 LOG_FILE,
                 maxBytes=10*1024*1024,  # 10MB
                 backupCount=0,  # 不保留备份，只保留最新的
-                encoding='utf-8'
+                encoding='utf-8',
+                delay=True  # 首次写入时才打开文件
             )
             file_handler.setLevel(logging.DEBUG)
             file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
+        except Exception as e:
+            file_error = e
+    
+    # 日志记录先放入队列，由后台线程统一格式化并写入控制台和文件，
+    # 避免 natter 输出监听等线程阻塞在磁盘 I/O 上
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # 退出时写完队列中剩余的日志
+    
+    if LOG_FILE:
+        if file_error:
+            logger.warning(f"⚠️  无法创建日志文件 {LOG_FILE}: {file_error}")
+        else:
             # 显示日志文件的绝对路径
             log_abs_path = os.path.abspath(LOG_FILE)
             logger.info(f"📝 日志文件已配置: {log_abs_path}")
-        except Exception as e:
-            logger.warning(f"⚠️  无法创建日志文件 {LOG_FILE}: {e}")
     
     return logger
 
@@ -116,8 +202,7 @@ logger = setup_logger()
 
 def get_frps_paths():
     """根据操作系统获取frps路径"""
-    system = platform.system()
-    if system == 'Windows':
+    if IS_WINDOWS:
         exe = os.path.join(BASE_DIR, 'Windows', 'frps.exe')
         conf = os.path.join(BASE_DIR, 'Windows', 'frps.toml')
     else:
@@ -128,34 +213,42 @@ def get_frps_paths():
 
 FRPS_EXE_PATH, FRPS_CONFIG_PATH = get_frps_paths()
 
+# Windows: 为 natter 和 frps 创建新的进程组，便于单独发送 CTRL_BREAK_EVENT
+POPEN_CREATION_FLAGS = subprocess.CREATE_NEW_PROCESS_GROUP if IS_WINDOWS else 0
+
 
 def read_stun_port_config():
-    """读取Stun_Port.toml配置文件，获取需要打洞的端口配置"""
+    """读取Stun_Port.toml配置文件，获取需要打洞的端口配置（文件未修改时直接使用缓存）"""
+    global stun_port_config_cache
     try:
-        if not os.path.exists(STUN_PORT_CONFIG):
+        try:
+            mtime_ns = os.stat(STUN_PORT_CONFIG).st_mtime_ns
+        except FileNotFoundError:
             logger.error(f"❌ 配置文件不存在: {STUN_PORT_CONFIG}")
             return {}
         
-        with open(STUN_PORT_CONFIG, 'r', encoding='utf-8') as f:
-            content = f.read().strip().split('\n')
+        if stun_port_config_cache and stun_port_config_cache[0] == mtime_ns:
+            return dict(stun_port_config_cache[1])
         
         # 解析端口配置
         # 支持格式: 
         # 1. port_name=port_number  (例如: server_port=7000)
         # 2. port_name              (例如: server_port, 自动分配端口)
         port_config = {}
-        for line_num, line in enumerate(content, 1):
+        with open(STUN_PORT_CONFIG, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        for line_num, line in enumerate(lines, 1):
             line = line.strip()
             # 跳过空行和注释
-            if not line or line.startswith('#'):
+            if not line or line[0] == '#':
                 continue
             
             # 解析格式: name=port 或 name
-            if '=' in line:
-                parts = line.split('=', 1)
-                port_name = parts[0].strip()
+            port_name, sep, port_value = line.partition('=')
+            if sep:
+                port_name = port_name.strip()
                 try:
-                    port_number = int(parts[1].strip())
+                    port_number = int(port_value)
                     if not (0 <= port_number <= 65535):
                         logger.warning(f"⚠️  第{line_num}行: 端口号超出范围 (0-65535): {line}")
                         continue
@@ -165,8 +258,7 @@ def read_stun_port_config():
                     continue
             else:
                 # 没有指定端口号，使用 0 (自动分配)
-                port_name = line
-                if not port_name.replace('_', '').isalnum():
+                if not PORT_NAME_RE.fullmatch(port_name):
                     logger.warning(f"⚠️  第{line_num}行: 端口名称包含非法字符: {line}")
                     continue
                 port_config[port_name] = 0
@@ -181,12 +273,44 @@ def read_stun_port_config():
             return {}
         
         logger.info(f"📋 读取到 {len(port_config)} 个端口配置: {', '.join([f'{k}={v}' if v > 0 else f'{k}(自动)' for k, v in port_config.items()])}")
-        return port_config
+        stun_port_config_cache = (mtime_ns, port_config)
+        return dict(port_config)
     except Exception as e:
-        logger.error(f"❌ 读取 Stun_Port.toml 失败: {e}", exc_info=True)
+        # 仅在调试模式下附带堆栈，避免循环中反复格式化 traceback
+        logger.error(f"❌ 读取 Stun_Port.toml 失败: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
         return {}
     
 
+def wait_process_exit(process, timeout):
+    """
+    等待进程退出，超时抛出 subprocess.TimeoutExpired（与 Popen.wait 一致）
+    Linux 上通过 pidfd 在进程退出的瞬间返回，避免 Popen.wait 超时模式下的定时轮询
+    
+    Args:
+        process: subprocess.Popen 对象
+        timeout: 最长等待时间（秒）
+    
+    Returns:
+        int: 进程返回码
+    """
+    if hasattr(os, 'pidfd_open') and process.returncode is None:
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            pidfd = None  # 进程已被回收，直接由 Popen.wait 获取返回码
+        if pidfd is not None:
+            try:
+                with selectors.DefaultSelector() as selector:
+                    selector.register(pidfd, selectors.EVENT_READ)
+                    exited = bool(selector.select(timeout))
+            finally:
+                os.close(pidfd)
+            # 进程已退出时留出短暂宽限：输出监听线程可能正在 process.wait() 中回收该进程
+            # 并持有 Popen 内部锁，timeout=0 会误报超时
+            return process.wait(timeout=0.5 if exited else 0)
+    return process.wait(timeout=timeout)
+
+
 def safe_terminate_process(process, process_name="进程", timeout_terminate=5, timeout_kill=2):
     """
     安全地终止进程，先尝试 terminate，超时后使用 kill
@@ -205,16 +329,32 @@ def safe_terminate_process(process, process_name="进程", timeout_terminate=5,
     
     try:
         logger.info(f"🛑 正在终止 {process_name} (PID: {process.pid})...")
-        process.terminate()
+        if IS_WINDOWS:
+            # Windows: terminate 等同于强制结束，改为发送 CTRL_BREAK_EVENT 让进程正常退出
+            try:
+                process.send_signal(signal.CTRL_BREAK_EVENT)
+            except OSError as e:
+                # 无控制台运行（pythonw、服务、计划任务）时无法发送控制台事件，直接强制结束
+                logger.warning(f"⚠️  无法向 {process_name} 发送 CTRL_BREAK_EVENT ({e})，使用 kill 强制结束...")
+                process.kill()
+                try:
+                    wait_process_exit(process, timeout_kill)
+                    logger.warning(f"✅ {process_name} 已强制结束")
+                    return True
+                except subprocess.TimeoutExpired:
+                    logger.error(f"❌ {process_name} 可能未完全结束")
+                    return False
+        else:
+            process.terminate()
         try:
-            process.wait(timeout=timeout_terminate)
+            wait_process_exit(process, timeout_terminate)
             logger.info(f"✅ {process_name} 已正常终止")
             return True
         except subprocess.TimeoutExpired:
             logger.warning(f"⚠️  {process_name} 未响应 terminate，使用 kill 强制结束...")
             process.kill()
             try:
-                process.wait(timeout=timeout_kill)
+                wait_process_exit(process, timeout_kill)
                 logger.warning(f"✅ {process_name} 已强制结束")
                 return True
             except:
@@ -225,7 +365,7 @@ def safe_terminate_process(process, process_name="进程", timeout_terminate=5,
         return False
 
 
-def run_natter_for_port(port_name, local_port=0, max_retries=3):
+def run_natter_for_port(port_name, local_port=0, max_retries=NATTER_MAX_RETRIES):
     """
     为指定端口运行natter进行STUN打洞
     port_name: 端口名称 (如 server_port)
@@ -235,8 +375,10 @@ def run_natter_for_port(port_name, local_port=0, max_retries=3):
     """
     for retry in range(max_retries):
         if retry > 0:
-            logger.info(f"{port_name} 第 {retry + 1}/{max_retries} 次尝试打洞...")
-            time.sleep(2)  # 重试前等待2秒
+            # 重试前等待：指数退避 + 随机抖动
+            delay = min(NATTER_RETRY_BASE_DELAY * 2 ** (retry - 1) + random.uniform(0, 0.5), NATTER_RETRY_MAX_DELAY)
+            logger.info(f"{port_name} 第 {retry + 1}/{max_retries} 次尝试打洞 (等待 {delay:.1f} 秒)...")
+            time.sleep(delay)
         
         try:
             logger.info(f"🔌 正在为 {port_name} (本地端口: {local_port if local_port > 0 else '自动分配'}) 启动 natter 打洞...")
@@ -258,42 +400,36 @@ def run_natter_for_port(port_name, local_port=0, max_retries=3):
                 cmd.extend(['-b', '0'])  # 0表示自动分配端口
             
             # 启动natter进程
-            # 合并 stdout 和 stderr,避免遗漏错误信息
+            # 合并 stdout 和 stderr,避免遗漏错误信息；以字节读取，普通日志行无需解码
             process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,  # 合并到 stdout
-                text=True,
-                bufsize=0,  # 无缓冲,立即输出
-                universal_newlines=True
+                creationflags=POPEN_CREATION_FLAGS
             )
             
             # 等待并解析natter输出获取映射信息
+            # readline 阻塞等待下一行，超时由定时器终止 natter，管道关闭后 readline 立即返回
             timeout = 15  # 15秒超时 (给予足够时间建立连接)
-            start_time = time.time()
+            start_time = time.monotonic()
+            timeout_timer = threading.Timer(timeout, process.terminate)
+            timeout_timer.daemon = True
+            timeout_timer.start()
             
-            while time.time() - start_time < timeout:
-                if process.poll() is not None:
-                    # 进程已结束
-                    remaining_output = process.stdout.read()
-                    logger.error(f"❌ natter 进程异常退出")
-                    if remaining_output:
-                        logger.debug(f"输出: {remaining_output}")
-                    break  # 跳出内层循环,继续重试
-                
-                line = process.stdout.readline()
-                if line:
-                    line = line.strip()
-                    logger.debug(f"[NATTER] {line}")
+            try:
+                for line in process.stdout:
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"[NATTER] {line.strip().decode(errors='replace')}")
                     
                     # 解析映射地址信息
                     # 格式: "tcp://内网IP:内网端口 <--Natter--> tcp://公网IP:公网端口"
-                    if '<--Natter-->' in line:
-                        match = re.search(r'tcp://([0-9.]+):(\d+)\s+<--Natter-->\s+tcp://([0-9.]+):(\d+)', line)
+                    if NATTER_MARK in line:
+                        match = NATTER_RE.search(line)
                         if match:
-                            local_ip = match.group(1)
+                            timeout_timer.cancel()
+                            local_ip = match.group(1).decode()
                             actual_local_port = int(match.group(2))
-                            public_ip = match.group(3)
+                            public_ip = match.group(3).decode()
                             public_port = int(match.group(4))
                             
                             logger.info(f"✅ {port_name} 打洞成功")
@@ -311,8 +447,12 @@ def run_natter_for_port(port_name, local_port=0, max_retries=3):
                             logger.debug(f"已启动 {port_name} 的 natter 输出监听线程")
                             
                             return public_ip, public_port, actual_local_port, process
-                
-                time.sleep(0.1)
+            finally:
+                timeout_timer.cancel()
+            
+            if time.monotonic() - start_time < timeout:
+                # 未到超时时间就读到 EOF，说明进程已结束
+                logger.error(f"❌ natter 进程异常退出 (返回码: {process.wait()})")
             
             # 超时或失败,清理进程后重试
             logger.warning(f"⚠️  {port_name} 第 {retry + 1} 次打洞超时，未获取到映射地址")
@@ -320,7 +460,7 @@ def run_natter_for_port(port_name, local_port=0, max_retries=3):
                 safe_terminate_process(process, f"{port_name} natter", timeout_terminate=5, timeout_kill=2)
                 
         except Exception as e:
-            logger.error(f"❌ 运行 natter 失败 ({port_name}) 第 {retry + 1} 次: {e}", exc_info=True)
+            logger.error(f"❌ 运行 natter 失败 ({port_name}) 第 {retry + 1} 次: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
             # 清理可能存在的进程
             try:
                 if 'process' in locals() and process:
@@ -348,38 +488,26 @@ def monitor_natter_output(port_name, process):
     try:
         logger.debug(f"开始监听 {port_name} 的 natter 输出...")
         
-        while True:
-            # 检查进程是否还在运行
-            if process.poll() is not None:
-                logger.debug(f"{port_name} 的 natter 进程已退出，停止监听")
-                break
-            
-            # 读取输出
-            line = process.stdout.readline()
-            if not line:
-                time.sleep(0.1)
-                continue
-            
-            line = line.strip()
-            if not line:
-                continue
-            
-            logger.debug(f"[NATTER-{port_name}] {line}")
+        # 阻塞读取输出，natter 退出关闭管道后读到 EOF 结束循环
+        for line in process.stdout:
+            if logger.isEnabledFor(logging.DEBUG) and line.strip():
+                logger.debug(f"[NATTER-{port_name}] {line.strip().decode(errors='replace')}")
             
             # 检测映射地址变化
             # 格式: "tcp://内网IP:内网端口 <--Natter--> tcp://公网IP:公网端口"
-            if '<--Natter-->' in line:
-                match = re.search(r'tcp://([0-9.]+):(\d+)\s+<--Natter-->\s+tcp://([0-9.]+):(\d+)', line)
+            if NATTER_MARK in line:
+                match = NATTER_RE.search(line)
                 if match:
-                    local_ip = match.group(1)
+                    local_ip = match.group(1).decode()
                     actual_local_port = int(match.group(2))
-                    new_public_ip = match.group(3)
+                    new_public_ip = match.group(3).decode()
                     new_public_port = int(match.group(4))
                     
-                    # 检查内存中的记录是否需要更新
-                    if port_name in natter_processes:
-                        old_public_port = natter_processes[port_name]['public_port']
-                        old_public_ip = natter_processes[port_name]['public_ip']
+                    # 检查内存中的记录是否需要更新（记录已属于重启后的新进程时不再更新）
+                    info = natter_processes.get(port_name)
+                    if info and info['process'] is process:
+                        old_public_port = info['public_port']
+                        old_public_ip = info['public_ip']
                         
                         if old_public_port != new_public_port or old_public_ip != new_public_ip:
                             logger.info(f"ℹ️  {port_name} 检测到映射地址变化:")
@@ -387,16 +515,54 @@ def monitor_natter_output(port_name, process):
                             logger.info(f"   └─ 新地址: {new_public_ip}:{new_public_port}")
                             
                             # 仅更新内存中的记录
-                            natter_processes[port_name]['public_ip'] = new_public_ip
-                            natter_processes[port_name]['public_port'] = new_public_port
-                            natter_processes[port_name]['local_port'] = actual_local_port
+                            info['public_ip'] = new_public_ip
+                            info['public_port'] = new_public_port
+                            info['local_port'] = actual_local_port
                             
-                            logger.info(f"✅ {port_name} 内存记录已更新，等待定期检查同步到 DNS")
+                            logger.info(f"✅ {port_name} 内存记录已更新，即将同步到 DNS")
+                            natter_event.set()
                         else:
                             logger.debug(f"{port_name} 映射地址无变化")
-                    
+        
+        logger.debug(f"{port_name} 的 natter 进程已退出，停止监听")
     except Exception as e:
-        logger.error(f"❌ 监听 {port_name} natter 输出失败: {e}", exc_info=True)
+        logger.error(f"❌ 监听 {port_name} natter 输出失败: {e}", exc_info=logger.isEnabledFor(logging.DEBUG))
+        # 继续读空管道，避免管道写满后 natter 阻塞在输出上导致保活中断
+        try:
+            for _ in process.stdout:
+                pass
+        except (OSError, ValueError):
+            pass
+    
+    # 管道关闭说明 natter 已退出；仍是当前记录的进程时唤醒主循环立即检查
+    # （主动清理的进程已先从记录中移除，不会触发）
+    process.wait()
+    info = natter_processes.get(port_name)
+    if info and info['process'] is process:
+        natter_event.set()
+
+
+def resolve_txt(domain):
+    """
+    同时向所有 DNS 服务器查询 TXT 记录，返回最先成功的结果
+    
+    Args:
+        domain: 域名
+    
+    Returns:
+        dns.resolver.Answer: 最先成功返回的应答
+    
+    Raises:
+        所有服务器均查询失败时，抛出最后一个异常
+    """
+    futures = [dns_executor.submit(resolver.resolve, domain, 'TXT') for resolver in dns_resolvers]
+    error = None
+    for future in as_completed(futures):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
 
 
 def get_current_dns_txt_record():
@@ -409,15 +575,8 @@ def get_current_dns_txt_record():
         {}: 记录为空
     """
     try:
-        # 配置 DNS 解析器
-        resolver = dns.resolver.Resolver()
-        resolver.cache = None  # 禁用缓存，获取最新记录
-        resolver.nameservers = ['1.1.1.1', '8.8.8.8']  # 使用 Cloudflare 和 Google DNS
-        resolver.timeout = 5  # 5秒超时
-        resolver.lifetime = 10  # 总生存时间10秒
-        
-        # 查询 TXT 记录
-        answers = resolver.resolve(DOMAIN, 'TXT')
+        # 查询 TXT 记录（并发查询所有 DNS 服务器，取最先成功的结果）
+        answers = resolve_txt(DOMAIN)
         
         if not answers:
             logger.debug("DNS TXT 记录为空")
@@ -432,7 +591,7 @@ def get_current_dns_txt_record():
                 logger.debug(f"DNS TXT 记录: {txt_content}")
                 
                 # 解析 server_port
-                server_match = re.search(r'server_port=(\d+)', txt_content)
+                server_match = TXT_SERVER_PORT_RE.search(txt_content)
                 if server_match:
                     port_mapping['server_port'] = {
                         'local': 0,  # server_port 不记录 local
@@ -441,8 +600,8 @@ def get_current_dns_txt_record():
                 
                 # 解析 client_portX
                 # 查找所有 client_local_portX 和 client_public_portX
-                local_ports = re.findall(r'client_local_(port\d+)=(\d+)', txt_content)
-                public_ports = re.findall(r'client_public_(port\d+)=(\d+)', txt_content)
+                local_ports = TXT_LOCAL_PORT_RE.findall(txt_content)
+                public_ports = TXT_PUBLIC_PORT_RE.findall(txt_content)
                 
                 # 构建字典
                 local_dict = {port: int(value) for port, value in local_ports}
@@ -472,6 +631,58 @@ def get_current_dns_txt_record():
         return None
 
 
+def write_file_atomic(path, content):
+    """
+    原子写入文件：先写临时文件并落盘，再通过 os.replace 替换，避免中途崩溃留下不完整的文件
+    
+    Args:
+        path: 目标文件路径
+        content: 文件内容
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_cloudflare_cache():
+    """读取上次运行缓存的 Zone ID 和记录 ID，域名变化时忽略缓存"""
+    global zone_id, dns_record_ids
+    
+    try:
+        with open(CLOUDFLARE_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        logger.warning(f"⚠️  读取 Cloudflare 缓存失败，将重新查询: {e}")
+        return
+    
+    if cache.get('domain') != DOMAIN or not cache.get('zone_id'):
+        return
+    
+    zone_id = cache['zone_id']
+    record_ids = cache.get('record_ids')
+    if isinstance(record_ids, dict):
+        dns_record_ids = {'A': record_ids.get('A'), 'TXT': record_ids.get('TXT')}
+    logger.debug(f"已加载 Cloudflare 缓存: zone_id={zone_id}, record_ids={dns_record_ids}")
+
+
+def save_cloudflare_cache():
+    """将 Zone ID 和记录 ID 写入缓存文件，下次启动时跳过查询"""
+    cache = {
+        'domain': DOMAIN,
+        'zone_id': zone_id,
+        'record_ids': dns_record_ids
+    }
+    try:
+        write_file_atomic(CLOUDFLARE_CACHE_FILE, json.dumps(cache))
+    except Exception as e:
+        logger.warning(f"⚠️  写入 Cloudflare 缓存失败: {e}")
+
+
 def get_zone_id():
     """
     获取 Cloudflare Zone ID（带缓存）
@@ -486,31 +697,35 @@ def get_zone_id():
         return zone_id
     
     try:
-        headers = {
-            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        
-        # 提取根域名
-        domain_parts = DOMAIN.split('.')
-        if len(domain_parts) >= 2:
-            root_domain = '.'.join(domain_parts[-2:])
-        else:
-            root_domain = DOMAIN
-        
-        # 查询 Zone ID
+        # 列出 Token 可访问的 Zone，取与域名后缀匹配的最长 Zone 名称
+        # 不按"最后两段"推断根域名，兼容 example.co.uk 这类多级后缀
         zone_query_url = 'https://api.cloudflare.com/client/v4/zones'
-        zone_params = {'name': root_domain}
-        zone_response = requests.get(zone_query_url, headers=headers, params=zone_params, timeout=10)
-        zone_response.raise_for_status()
+        domain = DOMAIN.lower().rstrip('.')
+        best_zone = None
+        page = 1
+        while True:
+            zone_params = {'per_page': 50, 'page': page}
+            zone_response = cloudflare_session.get(zone_query_url, params=zone_params, timeout=10)
+            zone_response.raise_for_status()
+            data = zone_response.json()
+            
+            for zone in data.get('result', []):
+                name = zone['name'].lower()
+                if (domain == name or domain.endswith('.' + name)) and (
+                        best_zone is None or len(name) > len(best_zone['name'])):
+                    best_zone = zone
+            
+            if page >= (data.get('result_info') or {}).get('total_pages', 1):
+                break
+            page += 1
         
-        zones = zone_response.json().get('result', [])
-        if not zones:
-            logger.error(f"未找到域名 {root_domain} 对应的 Zone")
+        if not best_zone:
+            logger.error(f"未找到域名 {DOMAIN} 对应的 Zone")
             return None
         
-        zone_id = zones[0]['id']
-        logger.info(f"✅ 获取 Zone ID: {zone_id}")
+        zone_id = best_zone['id']
+        logger.info(f"✅ 获取 Zone ID: {zone_id} ({best_zone['name']})")
+        save_cloudflare_cache()
         return zone_id
         
     except Exception as e:
@@ -518,144 +733,209 @@ def get_zone_id():
         return None
 
 
-def update_cloudflare_txt_record(port_mapping):
+def build_txt_content(port_mapping):
+    """
+    构造 TXT 记录内容
+    格式: server_port=public_port, client_local_portX=local_port,client_public_portX=public_port
+    
+    Args:
+        port_mapping: 例如 {'server_port': {'local': 7000, 'public': 12345}, 'client_port1': {'local': 7001, 'public': 12346}}
+    
+    Returns:
+        str: TXT 记录内容，server_port 在前、其余按名称排序，相同映射总是得到相同内容
+    """
+    # server_port 记录公网端口；其他端口记录本地端口和公网端口（从 client_portX 提取 portX 部分）
+    txt_parts = [
+        f"server_port={ports['public']}" if port_name == 'server_port' else
+        f"client_local_{port_name.removeprefix('client_')}={ports['local']},"
+        f"client_public_{port_name.removeprefix('client_')}={ports['public']}"
+        for port_name, ports in sorted(port_mapping.items(), key=lambda item: (item[0] != 'server_port', item[0]))
+    ]
+    return '"' + ','.join(txt_parts) + '"'
+
+
+def get_dns_record_ids(current_zone_id):
     """
-    更新Cloudflare DNS TXT记录
-    port_mapping: dict, 例如 {'server_port': {'local': 7000, 'public': 12345}, 'client_port1': {'local': 7001, 'public': 12346}}
+    获取域名现有 A 记录和 TXT 记录的 ID（带缓存），一次列表请求同时查询两种记录
+    
+    Args:
+        current_zone_id: Zone ID
+    
+    Returns:
+        dict: {'A': record_id, 'TXT': record_id}，记录不存在时为 None
     """
-    try:
-        if not CLOUDFLARE_API_TOKEN:
-            logger.error("❌ Cloudflare API Token 未配置")
-            return False
-        
-        # 获取 Zone ID
-        current_zone_id = get_zone_id()
-        if not current_zone_id:
-            return False
-        
-        # 构造TXT记录内容
-        # 格式: server_port=public_port, client_local_portX=local_port,client_public_portX=public_port
-        txt_parts = []
-        for port_name, ports in port_mapping.items():
-            if port_name == 'server_port':
-                # server_port 记录公网端口
-                txt_parts.append(f"{port_name}={ports['public']}")
-            else:
-                # 其他端口记录本地端口和公网端口
-                # 从 client_portX 提取 portX 部分
-                port_suffix = port_name.replace('client_', '')
-                txt_parts.append(f"client_local_{port_suffix}={ports['local']}")
-                txt_parts.append(f"client_public_{port_suffix}={ports['public']}")
-        txt_content = '"' + ','.join(txt_parts) + '"'
-        logger.info(f"📝 准备更新 TXT 记录: {txt_content}")
-        
-        headers = {
-            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-            'Content-Type': 'application/json'
-        }
-        
-        # 查询现有的TXT记录
-        list_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
-        params = {'type': 'TXT', 'name': DOMAIN}
-        response = requests.get(list_url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        
-        records = response.json().get('result', [])
-        
-        # 更新或创建记录
-        data = {
-            'type': 'TXT',
-            'name': DOMAIN,
-            'content': txt_content,
-            'ttl': 60
-        }
-        
-        if records:
-            # 更新现有记录
-            record_id = records[0]['id']
-            update_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records/{record_id}'
-            response = requests.put(update_url, headers=headers, json=data, timeout=10)
-        else:
-            # 创建新记录
-            create_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
-            response = requests.post(create_url, headers=headers, json=data, timeout=10)
-        
+    global dns_record_ids
+    
+    if dns_record_ids is not None:
+        return dns_record_ids
+    
+    list_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
+    response = cloudflare_session.get(list_url, params={'name': DOMAIN}, timeout=10)
+    response.raise_for_status()
+    
+    record_ids = {'A': None, 'TXT': None}
+    for record in response.json().get('result', []):
+        if record.get('type') in record_ids and record_ids[record['type']] is None:
+            record_ids[record['type']] = record['id']
+            record_contents[record['type']] = record.get('content')
+    
+    dns_record_ids = record_ids
+    save_cloudflare_cache()
+    return dns_record_ids
+
+
+def drop_unchanged_records(records):
+    """
+    移除内容与 Cloudflare 上已知内容相同的记录
+    
+    Args:
+        records: {记录类型: 记录数据}，原地修改
+    """
+    for record_type in [t for t, data in records.items() if record_contents.get(t) == data['content']]:
+        logger.debug(f"Cloudflare {record_type} 记录未变化，跳过更新")
+        del records[record_type]
+
+
+def update_records_individually(current_zone_id, payload):
+    """
+    批量接口不可用时的回退：并行发送每条记录的 PUT / POST 请求
+    
+    Args:
+        current_zone_id: Zone ID
+        payload: 批量接口的请求内容 {'puts': [...], 'posts': [...]}
+    
+    Returns:
+        dict: 与批量接口响应相同结构的结果
+    """
+    records_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
+    requests_count = len(payload['puts']) + len(payload['posts'])
+    with ThreadPoolExecutor(max_workers=requests_count) as executor:
+        futures = [
+            executor.submit(cloudflare_session.put, f"{records_url}/{record['id']}",
+                            json={k: v for k, v in record.items() if k != 'id'}, timeout=10)
+            for record in payload['puts']
+        ] + [
+            executor.submit(cloudflare_session.post, records_url, json=record, timeout=10)
+            for record in payload['posts']
+        ]
+        responses = [future.result() for future in futures]
+    
+    for response in responses:
         response.raise_for_status()
-        result = response.json()
-        
-        if result.get('success'):
-            logger.info("✅ Cloudflare TXT 记录已更新")
-            return True
-        else:
-            logger.error(f"❌ Cloudflare API 返回错误: {result.get('errors')}")
-            return False
-            
-    except Exception as e:
-        logger.error(f"❌ 更新 Cloudflare TXT 记录失败: {e}")
-        return False
+    results = [response.json() for response in responses]
+    
+    return {
+        'success': all(result.get('success') for result in results),
+        'errors': [error for result in results for error in result.get('errors') or []],
+        'result': {'posts': [result['result'] for result in results[len(payload['puts']):] if result.get('success')]}
+    }
 
 
-def update_cloudflare_a_record(public_ip):
+def update_cloudflare_records(public_ip, port_mapping, force=False):
     """
-    更新Cloudflare DNS A记录
-    public_ip: 公网IP地址
+    通过批量接口一次请求更新 Cloudflare DNS A 记录和 TXT 记录
+    与 Cloudflare 上已知内容（上次推送或查询到的）相同的记录会被跳过
+    
+    Args:
+        public_ip: 公网IP地址，为 None 时不更新 A 记录
+        port_mapping: 端口映射（格式见 build_txt_content），为 None 时不更新 TXT 记录
+        force: 是否忽略上次推送的内容强制更新（DNS 与内存不一致时使用）
+    
+    Returns:
+        bool: 是否更新成功
     """
+    global zone_id, dns_record_ids
+    
     try:
         if not CLOUDFLARE_API_TOKEN:
             logger.error("❌ Cloudflare API Token 未配置")
             return False
         
+        # 构造需要更新的记录
+        records = {}
+        if public_ip:
+            records['A'] = {
+                'type': 'A',
+                'name': DOMAIN,
+                'content': public_ip,
+                'ttl': 60,
+                'proxied': False
+            }
+        if port_mapping is not None:
+            records['TXT'] = {
+                'type': 'TXT',
+                'name': DOMAIN,
+                'content': build_txt_content(port_mapping),
+                'ttl': 60
+            }
+        if not force:
+            drop_unchanged_records(records)
+        if not records:
+            return True
+        
         # 获取 Zone ID
         current_zone_id = get_zone_id()
         if not current_zone_id:
             return False
         
-        logger.info(f"📝 准备更新 A 记录: {DOMAIN} -> {public_ip}")
+        # 首次查询记录 ID 时同时得到记录当前内容，再次跳过未变化的记录
+        record_ids = get_dns_record_ids(current_zone_id)
+        if not force:
+            drop_unchanged_records(records)
+        if not records:
+            return True
         
-        headers = {
-            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-            'Content-Type': 'application/json'
-        }
+        if 'A' in records:
+            logger.info(f"📝 准备更新 A 记录: {DOMAIN} -> {public_ip}")
+        if 'TXT' in records:
+            logger.info(f"📝 准备更新 TXT 记录: {records['TXT']['content']}")
         
-        # 查询现有的A记录
-        list_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
-        params = {'type': 'A', 'name': DOMAIN}
-        response = requests.get(list_url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
+        # 已有记录整体覆盖，不存在的记录新建
+        payload = {'puts': [], 'posts': []}
+        for record_type, data in records.items():
+            if record_ids[record_type]:
+                payload['puts'].append({'id': record_ids[record_type], **data})
+            else:
+                payload['posts'].append(data)
         
-        records = response.json().get('result', [])
+        batch_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records/batch'
+        response = cloudflare_session.post(batch_url, json=payload, timeout=10)
+        if response.status_code in (404, 405):
+            # 批量接口不可用，改为逐条记录并行更新
+            logger.debug(f"Cloudflare 批量接口不可用 (HTTP {response.status_code})，改为逐条更新")
+            result = update_records_individually(current_zone_id, payload)
+        else:
+            response.raise_for_status()
+            result = response.json()
         
-        # 更新或创建记录
-        data = {
-            'type': 'A',
-            'name': DOMAIN,
-            'content': public_ip,
-            'ttl': 60,
-            'proxied': False
-        }
+        if not result.get('success'):
+            logger.error(f"❌ Cloudflare API 返回错误: {result.get('errors')}")
+            zone_id = dns_record_ids = None  # 缓存的 ID 可能已失效，下次重新查询
+            record_contents.clear()
+            return False
         
-        if records:
-            # 更新现有记录
-            record_id = records[0]['id']
-            update_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records/{record_id}'
-            response = requests.put(update_url, headers=headers, json=data, timeout=10)
-        else:
-            # 创建新记录
-            create_url = f'https://api.cloudflare.com/client/v4/zones/{current_zone_id}/dns_records'
-            response = requests.post(create_url, headers=headers, json=data, timeout=10)
+        # 记录新建记录的 ID，后续直接覆盖
+        created = (result.get('result') or {}).get('posts') or []
+        for record in created:
+            record_ids[record['type']] = record['id']
+        if created:
+            save_cloudflare_cache()
         
-        response.raise_for_status()
-        result = response.json()
+        for record_type, data in records.items():
+            record_contents[record_type] = data['content']
         
-        if result.get('success'):
+        if 'A' in records:
             logger.info(f"✅ Cloudflare A 记录已更新: {DOMAIN} -> {public_ip}")
-            return True
-        else:
-            logger.error(f"❌ Cloudflare API 返回错误: {result.get('errors')}")
-            return False
-            
+        if 'TXT' in records:
+            logger.info("✅ Cloudflare TXT 记录已更新")
+        return True
+        
     except Exception as e:
-        logger.error(f"❌ 更新 Cloudflare A 记录失败: {e}")
+        logger.error(f"❌ 更新 Cloudflare DNS 记录失败: {e}")
+        # 只有 4xx 错误说明缓存的 ID 可能已失效，网络错误和 5xx 时保留缓存
+        if isinstance(e, requests.HTTPError) and e.response is not None and 400 <= e.response.status_code < 500:
+            zone_id = dns_record_ids = None  # 下次重新查询
+            record_contents.clear()
         return False
 
 
@@ -664,12 +944,20 @@ def update_frps_config(local_port):
     更新 frps.toml 配置文件中的 bindPort 和 auth.token
     local_port: natter 映射的本地端口(来自 Stun_Port.toml 的 server_port)
     """
+    global frps_config_applied
     try:
+        # 端口和 token 与上次确认的一致且文件未被修改时，无需读取配置文件
+        mtime_ns = os.stat(FRPS_CONFIG_PATH).st_mtime_ns
+        if frps_config_applied == (mtime_ns, local_port, FRP_TOKEN):
+            return True
+        
         # 读取 frps.toml
         with open(FRPS_CONFIG_PATH, 'r', encoding='utf-8') as f:
-            config = toml.load(f)
+            content = f.read()
+        config = tomllib.loads(content)
         
         changed = False
+        full_rewrite = False  # 是否需要完整重写配置文件
         
         # 检查并更新 bindPort
         old_bind_port = config.get('bindPort')
@@ -688,14 +976,23 @@ def update_frps_config(local_port):
                 config['auth']['method'] = 'token'
                 config['auth']['token'] = FRP_TOKEN
                 changed = True
+                full_rewrite = True
                 logger.info("⚙️  frps.toml auth.token 已更新")
         
         if not changed:
+            frps_config_applied = (mtime_ns, local_port, FRP_TOKEN)
             return True  # 无变化
         
-        # 写回文件
-        with open(FRPS_CONFIG_PATH, 'w', encoding='utf-8') as f:
-            toml.dump(config, f)
+        # 仅 bindPort 变化时按行替换，保留文件中的注释和格式；否则完整重写
+        count = 0
+        if not full_rewrite:
+            content, count = BIND_PORT_RE.subn(lambda m: m.group(1) + str(local_port), content, count=1)
+        if not count:
+            content = toml.dumps(config)
+        
+        # 原子写回文件，避免 frps 因配置文件写入不完整而无法启动
+        write_file_atomic(FRPS_CONFIG_PATH, content)
+        frps_config_applied = (os.stat(FRPS_CONFIG_PATH).st_mtime_ns, local_port, FRP_TOKEN)
         
         return True 
         
@@ -706,22 +1003,15 @@ def update_frps_config(local_port):
 
 def start_frps():
     """启动frps服务"""
-    global frps_process
+    global frps_process, frps_bind_port
     try:
-        # Windows 上不使用 shell=True，避免子进程无法终止
-        # 改为直接使用可执行文件路径
-        if platform.system() == 'Windows':
-            # Windows: 创建新的进程组，便于终止
-            CREATE_NEW_PROCESS_GROUP = 0x00000200
-            frps_process = subprocess.Popen(
-                [FRPS_EXE_PATH, '-c', FRPS_CONFIG_PATH],
-                creationflags=CREATE_NEW_PROCESS_GROUP
-            )
-        else:
-            # Linux/Unix: 直接启动
-            frps_process = subprocess.Popen(
-                [FRPS_EXE_PATH, '-c', FRPS_CONFIG_PATH]
-            )
+        # 不使用 shell=True，直接启动可执行文件，信号直达 frps 本身
+        frps_process = subprocess.Popen(
+            [FRPS_EXE_PATH, '-c', FRPS_CONFIG_PATH],
+            creationflags=POPEN_CREATION_FLAGS
+        )
+        # update_frps_config 在启动前调用，此时记录的 bindPort 即新进程监听的端口
+        frps_bind_port = frps_config_applied[1] if frps_config_applied else None
         logger.info("✅ frps 已启动")
         return True
     except Exception as e:
@@ -730,6 +1020,29 @@ def start_frps():
         return False
 
 
+def wait_port_released(port, timeout=3):
+    """
+    等待本机端口不再被监听（连接被拒绝即视为已释放）
+    
+    Args:
+        port: 端口号
+        timeout: 最长等待时间（秒）
+    
+    Returns:
+        bool: 端口在超时前已释放返回 True，否则返回 False
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.2):
+                pass
+        except OSError:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
 def restart_frps():
     """重启frps服务"""
     global frps_process
@@ -739,9 +1052,12 @@ def restart_frps():
             if not safe_terminate_process(frps_process, "frps", timeout_terminate=10, timeout_kill=5):
                 logger.warning("⚠️  frps 可能未完全关闭，但仍继续重启流程")
             
-            # 等待服务器完全释放所有代理连接
-            logger.debug("等待服务器完全关闭并释放资源...")
-            time.sleep(3)
+            # 等待旧进程的 bindPort 释放后再启动，端口已空闲时无需等待
+            # 调用方已先更新 frps.toml，frps_config_applied 中是新端口，这里必须用旧进程启动时的端口
+            if frps_bind_port:
+                logger.debug("等待服务器完全关闭并释放端口...")
+                if not wait_port_released(frps_bind_port):
+                    logger.warning(f"⚠️  端口 {frps_bind_port} 仍被占用，继续启动 frps")
         
         # 重置进程对象
         frps_process = None
@@ -774,12 +1090,18 @@ def perform_stun_and_update():
         logger.error("❌ 未找到需要打洞的端口配置")
         return False
     
-    # 2. 为每个端口执行STUN打洞
+    # 2. 为每个端口并行执行STUN打洞，总耗时取决于最慢的端口
     port_mapping = {}
     failed_ports = []  # 记录失败的端口
     
-    for port_name, local_port in port_config.items():
-        public_ip, public_port, actual_local_port, process = run_natter_for_port(port_name, local_port)
+    with ThreadPoolExecutor(max_workers=len(port_config), thread_name_prefix='Natter') as executor:
+        futures = {
+            port_name: executor.submit(run_natter_for_port, port_name, local_port)
+            for port_name, local_port in port_config.items()
+        }
+    
+    for port_name, future in futures.items():
+        public_ip, public_port, actual_local_port, process = future.result()
         
         if public_port and process:
             port_mapping[port_name] = {
@@ -830,14 +1152,9 @@ def perform_stun_and_update():
         logger.info(f"✅ frps 已重启，监听端口: {server_local_port}")
     
     # 5. 更新 Cloudflare DNS 记录
-    # 获取 server_port 的公网 IP
+    # A 记录 (域名解析到 server_port 的公网IP) 与 TXT 记录 (端口映射信息) 一次提交
     server_public_ip = natter_processes['server_port']['public_ip']
-    
-    # 更新 A 记录 (域名解析到公网IP)
-    update_cloudflare_a_record(server_public_ip)
-    
-    # 更新 TXT 记录 (端口映射信息)
-    update_cloudflare_txt_record(port_mapping)
+    update_cloudflare_records(server_public_ip, port_mapping)
     
     logger.info("")
     logger.info("="*70)
@@ -848,6 +1165,24 @@ def perform_stun_and_update():
     return True
 
 
+def sync_dns_records(server_public_ip, port_mapping):
+    """
+    强制将端口映射同步到 Cloudflare（在 cloudflare_executor 后台线程中执行）
+    
+    Args:
+        server_public_ip: server_port 的公网 IP，为 None 时不更新 A 记录
+        port_mapping: 端口映射信息
+    """
+    global dns_verified_at
+    
+    success = update_cloudflare_records(server_public_ip, port_mapping, force=True)
+    if success:
+        logger.info("✅ DNS 记录已同步")
+        dns_verified_at = time.monotonic()
+    else:
+        logger.warning("⚠️  DNS 记录同步失败")
+
+
 def check_natter_processes():
     """
     检查 natter 进程是否正常运行，并对比内存与 DNS 记录
@@ -857,7 +1192,7 @@ def check_natter_processes():
     Returns:
         list: 异常退出的端口名称列表，如果全部正常则返回空列表
     """
-    global natter_processes
+    global natter_processes, dns_verified_at
     
     failed_ports = []
     
@@ -873,15 +1208,6 @@ def check_natter_processes():
     # 2. 对比内存与 DNS，同步映射信息
     if not failed_ports:  # 只有在没有异常进程时才进行同步检查
         try:
-            logger.debug("🔍 检查内存与 DNS 记录是否一致...")
-            
-            # 查询当前 DNS 记录
-            current_dns = get_current_dns_txt_record()
-            
-            if current_dns is None:
-                logger.warning("⚠️  无法查询 DNS 记录，跳过本次同步检查")
-                return failed_ports
-            
             # 构建内存中的端口映射
             memory_mapping = {
                 pname: {
@@ -889,47 +1215,52 @@ def check_natter_processes():
                     'public': info['public_port']
                 }
                 for pname, info in natter_processes.items()
-                if info['process'].poll() is None  # 只包含运行中的进程
+                # 只包含运行中的进程；上面刚轮询过，直接读取 poll() 缓存的 returncode
+                if info['process'].returncode is None
             }
             
-            # 对比内存与 DNS
-            needs_update = False
-            changes = []
+            # A 记录使用 server_port 的公网 IP，与 TXT 记录一次提交
+            server_public_ip = None
+            if 'server_port' in natter_processes:
+                server_public_ip = natter_processes['server_port']['public_ip']
             
-            for port_name, memory_ports in memory_mapping.items():
-                dns_public_port = None
-                if port_name in current_dns:
-                    dns_public_port = current_dns[port_name]['public']
-                
-                if dns_public_port != memory_ports['public']:
-                    needs_update = True
-                    changes.append(f"{port_name}: DNS={dns_public_port or '无'} → 内存={memory_ports['public']}")
+            # 内存与最近一次推送到 Cloudflare 的内容一致，且近期已校验过，跳过 DNS 查询
+            if (dns_verified_at is not None
+                    and time.monotonic() - dns_verified_at < DNS_VERIFY_INTERVAL
+                    and record_contents.get('TXT') == build_txt_content(memory_mapping)
+                    and record_contents.get('A') == server_public_ip):
+                logger.debug("✅ 内存与最近推送的记录一致，跳过 DNS 查询")
+                return failed_ports
             
-            # 检查 DNS 中是否有内存中不存在的端口（可能是进程已退出但 DNS 未清理）
-            for port_name in current_dns:
-                if port_name not in memory_mapping:
-                    needs_update = True
-                    changes.append(f"{port_name}: DNS 中存在但内存中已移除")
+            logger.debug("🔍 检查内存与 DNS 记录是否一致...")
+            
+            # 查询当前 DNS 记录
+            current_dns = get_current_dns_txt_record()
+            
+            if current_dns is None:
+                logger.warning("⚠️  无法查询 DNS 记录，跳过本次同步检查")
+                return failed_ports
+            
+            # 对比内存与 DNS：(端口名称, 公网端口) 集合的对称差即为不一致的端口
+            memory_set = {(pname, ports['public']) for pname, ports in memory_mapping.items()}
+            dns_set = {(pname, ports['public']) for pname, ports in current_dns.items()}
+            diff = memory_set ^ dns_set
             
             # 如果有差异，更新 DNS
-            if needs_update:
+            if diff:
                 logger.info("ℹ️  检测到内存与 DNS 不一致:")
-                for change in changes:
-                    logger.info(f"   ├─ {change}")
+                for port_name in sorted({pname for pname, _ in diff}):
+                    if port_name not in memory_mapping:
+                        # DNS 中有内存中不存在的端口（可能是进程已退出但 DNS 未清理）
+                        logger.info(f"   ├─ {port_name}: DNS 中存在但内存中已移除")
+                    else:
+                        dns_public_port = current_dns.get(port_name, {}).get('public')
+                        logger.info(f"   ├─ {port_name}: DNS={dns_public_port or '无'} → 内存={memory_mapping[port_name]['public']}")
                 logger.info("📝 正在同步内存数据到 DNS...")
-                
-                # 更新 A 记录（使用 server_port 的公网 IP）
-                if 'server_port' in natter_processes:
-                    server_public_ip = natter_processes['server_port']['public_ip']
-                    update_cloudflare_a_record(server_public_ip)
-                
-                # 更新 TXT 记录
-                if update_cloudflare_txt_record(memory_mapping):
-                    logger.info("✅ DNS 记录已同步")
-                else:
-                    logger.warning("⚠️  DNS 记录同步失败")
+                cloudflare_executor.submit(sync_dns_records, server_public_ip, memory_mapping)
             else:
                 logger.debug("✅ 内存与 DNS 记录一致，无需更新")
+                dns_verified_at = time.monotonic()
                 
         except Exception as e:
             logger.error(f"❌ 检查内存与 DNS 一致性失败: {e}", exc_info=True)
@@ -952,74 +1283,99 @@ def validate_cloudflare_config():
 
 def validate_natter_executable():
     """验证 natter 是否存在且可访问"""
-    if not os.path.exists(NATTER_PATH):
+    if not os.path.isfile(NATTER_PATH):
         logger.error(f"❌ Natter 不存在: {NATTER_PATH}")
         return False
     
+    # 打包版直接执行 natter 可执行文件，需要执行权限；源码版通过 Python 解释器运行 natter.py
+    if getattr(sys, 'frozen', False) and not os.access(NATTER_PATH, os.X_OK):
+        logger.error(f"❌ Natter 没有执行权限: {NATTER_PATH}")
+        return False
+    
     return True
 
 
 def validate_frps_executable():
     """验证 frps 可执行文件是否存在"""
-    if not os.path.exists(FRPS_EXE_PATH):
+    if not os.path.isfile(FRPS_EXE_PATH):
         logger.error(f"❌ frps 可执行文件不存在: {FRPS_EXE_PATH}")
         return False
     
-    if not os.path.exists(FRPS_CONFIG_PATH):
+    # 解压或复制后可能丢失执行权限，提前发现比 Popen 失败更直观
+    if not os.access(FRPS_EXE_PATH, os.X_OK):
+        logger.error(f"❌ frps 没有执行权限: {FRPS_EXE_PATH}")
+        return False
+    
+    if not os.path.isfile(FRPS_CONFIG_PATH):
         logger.error(f"❌ frps 配置文件不存在: {FRPS_CONFIG_PATH}")
         return False
     
     return True
 
 
-def cleanup_natter_processes(port_names=None):
-    """
-    清理 natter 进程
-    
-    Args:
-        port_names: 要清理的端口名称列表，如果为 None 则清理所有进程
-    """
+def cleanup_natter_processes():
+    """清理所有 natter 进程"""
     global natter_processes
     
-    if port_names is None:
-        # 清理所有进程
-        logger.info("🧹 清理所有 natter 进程...")
-        ports_to_clean = list(natter_processes.keys())
-    else:
-        # 只清理指定的进程
-        logger.info(f"🧹 清理指定的 natter 进程: {', '.join(port_names)}")
-        ports_to_clean = port_names
+    logger.info("🧹 清理所有 natter 进程...")
     
-    for port_name in ports_to_clean:
+    running = []  # 仍在运行、需要终止的进程 (port_name, process)
+    for port_name in tuple(natter_processes):
         if port_name not in natter_processes:
             continue
             
         try:
-            info = natter_processes[port_name]
+            # 先从字典中移除，主动终止的进程不会唤醒主循环
+            with natter_lock:
+                info = natter_processes.pop(port_name)
             process = info['process']
             if process.poll() is None:
-                safe_terminate_process(process, f"{port_name} natter", timeout_terminate=3, timeout_kill=2)
+                running.append((port_name, process))
             else:
                 logger.debug(f"✅ {port_name} 的 natter 进程已退出")
-            
-            # 从字典中移除
-            del natter_processes[port_name]
         except Exception as e:
             logger.warning(f"⚠️  清理 {port_name} 的 natter 进程失败: {e}")
     
-    # 如果清理了所有进程，清空字典
-    if port_names is None:
-        natter_processes.clear()
+    # 同时终止所有进程，总耗时取决于最慢的进程，而不是逐个累加
+    if running:
+        with ThreadPoolExecutor(max_workers=len(running), thread_name_prefix='Terminate') as executor:
+            for port_name, process in running:
+                executor.submit(safe_terminate_process, process, f"{port_name} natter",
+                                timeout_terminate=3, timeout_kill=2)
     
-    # 等待端口释放
-    if ports_to_clean:
-        logger.debug("等待端口完全释放...")
-        time.sleep(2)
+    natter_processes.clear()
+
+
+def sync_natter_records():
+    """
+    将当前所有 natter 进程的映射信息一次性推送到 Cloudflare（A 记录 + TXT 记录）
+    
+    Returns:
+        bool: 是否更新成功（没有映射信息时返回 False）
+    """
+    # 构造端口映射
+    with natter_lock:
+        port_mapping = {
+            pname: {
+                'local': info['local_port'],
+                'public': info['public_port']
+            }
+            for pname, info in natter_processes.items()
+        }
+        # A 记录使用 server_port 的公网 IP，与 TXT 记录一次提交
+        server_public_ip = None
+        if 'server_port' in natter_processes:
+            server_public_ip = natter_processes['server_port']['public_ip']
+    
+    if not port_mapping:
+        return False
+    
+    return update_cloudflare_records(server_public_ip, port_mapping)
 
 
 def restart_single_natter(port_name):
     """
-    重启单个 natter 进程
+    重启单个 natter 进程（不更新 DNS，由调用方在全部端口重启完成后统一同步一次）
     
     Args:
         port_name: 端口名称
@@ -1032,8 +1388,9 @@ def restart_single_natter(port_name):
     logger.info(f"🔧 准备重启 {port_name} 的 natter 进程...")
     
     # 1. 获取原来的配置
-    if port_name in natter_processes:
-        old_local_port = natter_processes[port_name]['local_port']
+    old_info = natter_processes.get(port_name)
+    if old_info:
+        old_local_port = old_info['local_port']
     else:
         # 从配置文件重新读取
         port_config = read_stun_port_config()
@@ -1042,23 +1399,26 @@ def restart_single_natter(port_name):
             return False
         old_local_port = port_config[port_name]
     
-    # 2. 清理旧进程
-    cleanup_natter_processes([port_name])
+    # 2. 回收旧进程（需要重启的端口其旧进程通常已退出），但保留旧记录
+    if old_info:
+        safe_terminate_process(old_info['process'], f"{port_name} natter", timeout_terminate=3, timeout_kill=2)
     
     # 3. 重新打洞
     public_ip, public_port, actual_local_port, process = run_natter_for_port(port_name, old_local_port)
     
     if not (public_port and process):
+        # 保留旧记录，下次检查时仍会发现该端口异常并继续尝试
         logger.error(f"❌ {port_name} 重启失败")
         return False
     
-    # 4. 更新全局状态
-    natter_processes[port_name] = {
-        'process': process,
-        'public_ip': public_ip,
-        'public_port': public_port,
-        'local_port': actual_local_port
-    }
+    # 4. 更新全局状态：直接替换旧记录，新进程已绑定该端口，无需再等待端口释放
+    with natter_lock:
+        natter_processes[port_name] = {
+            'process': process,
+            'public_ip': public_ip,
+            'public_port': public_port,
+            'local_port': actual_local_port
+        }
     
     # 5. 如果是 server_port，需要检查端口是否变化
     if port_name == 'server_port' and actual_local_port != old_local_port:
@@ -1075,30 +1435,116 @@ def restart_single_natter(port_name):
             logger.error("❌ 重启 frps 失败")
             return False
     
-    # 6. 更新 Cloudflare DNS
-    # 构造新的端口映射
-    port_mapping = {
-        pname: {
-            'local': info['local_port'],
-            'public': info['public_port']
-        }
-        for pname, info in natter_processes.items()
-    }
-    
-    if port_mapping:
-        # 更新 A 记录（使用 server_port 的公网 IP）
-        if 'server_port' in natter_processes:
-            update_cloudflare_a_record(natter_processes['server_port']['public_ip'])
-        
-        # 更新 TXT 记录
-        update_cloudflare_txt_record(port_mapping)
-    
     logger.info(f"✅ {port_name} 重启成功")
     return True
 
 
+def wait_natter_event(timeout):
+    """
+    阻塞等待，直到超时、有 natter 进程退出或映射地址变化
+    natter 退出时其输出监听线程读到 EOF、映射变化时解析到新地址，并置位 natter_event，各平台行为一致
+    
+    Args:
+        timeout: 最长等待时间（秒）
+    
+    Returns:
+        bool: 是否有 natter 进程退出或映射地址变化
+    """
+    triggered = natter_event.wait(max(timeout, 0))
+    # 唤醒后由定期检查统一轮询所有进程，期间再次发生的事件会重新置位
+    natter_event.clear()
+    return triggered
+
+
+def monitor_loop():
+    """定期检查 natter 进程并同步 DNS，直到收到退出信号（KeyboardInterrupt）"""
+    # 定期检查：检查时间到达、有 natter 进程退出或映射地址变化时唤醒
+    # 持续正常时检查间隔逐次翻倍（上限 CHECK_INTERVAL_MAX），出现异常端口后恢复为 CHECK_INTERVAL
+    check_interval = CHECK_INTERVAL
+    last_check = time.monotonic()
+    next_check = last_check + check_interval
+    while True:
+        try:
+            if wait_natter_event(next_check - time.monotonic()):
+                # 有进程退出或映射变化时提前检查，但与上次检查保持最小间隔
+                logger.info("🔔 检测到 natter 进程退出或映射地址变化，提前检查...")
+                next_check = min(next_check, last_check + NATTER_EXIT_MIN_INTERVAL)
+            if time.monotonic() < next_check:
+                continue
+            last_check = time.monotonic()
+            next_check = last_check + check_interval
+            
+            logger.info("🔄 定期检查 natter 进程状态...")
+            
+            # 检查 natter 进程是否正常运行，并对比内存与 DNS 记录
+            failed_ports = check_natter_processes()
+            
+            if failed_ports:
+                logger.warning(f"⚠️ 检测到 {len(failed_ports)} 个端口异常: {', '.join(failed_ports)}")
+                logger.info(" 并行重启异常端口，不影响正常运行的端口...")
+                
+                # 各端口相互独立，并行重启，总耗时取决于最慢的端口
+                # 重启期间不单独更新 DNS，全部完成后合并为一次 A + TXT 更新
+                with ThreadPoolExecutor(max_workers=len(failed_ports), thread_name_prefix='Restart') as executor:
+                    results = list(executor.map(restart_single_natter, failed_ports))
+                if any(results):
+                    cloudflare_executor.submit(sync_natter_records)
+                
+                # 汇总输出重启结果
+                still_failed = [port_name for port_name, restarted in zip(failed_ports, results) if not restarted]
+                logger.info(f"✅ 成功重启 {len(failed_ports) - len(still_failed)}/{len(failed_ports)} 个端口")
+                if still_failed:
+                    logger.warning(f"⚠️  重启失败的端口: {', '.join(still_failed)}，将在下次检查时继续尝试")
+                check_interval = CHECK_INTERVAL
+            else:
+                logger.info("✅ 所有 natter 进程运行正常")
+                check_interval = min(check_interval * 2, CHECK_INTERVAL_MAX)
+            
+            next_check = last_check + check_interval
+            logger.debug(f"下次定期检查将在 {check_interval} 秒后进行")
+                
+        except Exception as e:
+            logger.error(f"❌ 主循环异常: {e}", exc_info=True)
+            # 不在这里清理 natter：仍在运行的映射继续保留，异常端口由下次检查单独重启
+            logger.info("⏱️  等待下次检查...")
+            # 在循环开头的可中断等待中退避 60 秒，期间收到退出信号可立即进入清理流程
+            last_check = time.monotonic()
+            next_check = last_check + 60
+
+
+def stop_services():
+    """停止所有 natter 进程和 frps，退出前调用"""
+    try:
+        # 取消排队中的 DNS 同步：其映射快照中的 natter 即将被终止，且退出时不应等待 Cloudflare 请求
+        cloudflare_executor.shutdown(wait=False, cancel_futures=True)
+        logger.info("🧹 清理资源...")
+        # natter 与 frps 同时终止，退出耗时取决于最慢的进程
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='Shutdown') as executor:
+            executor.submit(cleanup_natter_processes)
+            if frps_process and frps_process.poll() is None:
+                logger.info("🛑 停止 frps 进程...")
+                executor.submit(safe_terminate_process, frps_process, "frps", timeout_terminate=5, timeout_kill=2)
+        
+        logger.info("")
+        logger.info("="*70)
+        logger.info("👋 服务已停止")
+        logger.info("="*70)
+        logger.info("")
+    except:
+        # 清理过程中忽略所有异常，确保能正常退出
+        pass
+
+
+def handle_exit_signal(signum, frame):
+    """SIGTERM 处理：与 Ctrl+C 一样抛出 KeyboardInterrupt，走 main 中统一的清理流程"""
+    raise KeyboardInterrupt
+
+
 def main():
     """主循环"""
+    # systemd / docker stop 发送 SIGTERM，默认会直接结束进程而不清理 natter 和 frps
+    signal.signal(signal.SIGTERM, handle_exit_signal)
+    
     logger.info("")
     logger.info("="*70)
     logger.info("🌟 Stun_Frps 服务启动")
@@ -1128,64 +1574,22 @@ def main():
     logger.info("✅ 所有验证通过")
     logger.info("")
     
-    # 初始执行一次
-    if not perform_stun_and_update():
-        logger.error("❌ 初始打洞失败，程序退出")
-        sys.exit(1)
-    
-    # 定期检查
-    while True:
-        try:
-            time.sleep(CHECK_INTERVAL)
-            logger.info("🔄 定期检查 natter 进程状态...")
-            
-            # 检查 natter 进程是否正常运行，并对比内存与 DNS 记录
-            failed_ports = check_natter_processes()
-            
-            if failed_ports:
-                logger.warning(f"⚠️ 检测到 {len(failed_ports)} 个端口异常: {', '.join(failed_ports)}")
-                logger.info(" 逐个重启异常端口，不影响正常运行的端口...")
-                
-                # 逐个重启失败的端口
-                success_count = 0
-                for port_name in failed_ports:
-                    if restart_single_natter(port_name):
-                        success_count += 1
-                    else:
-                        logger.warning(f"⚠️  {port_name} 重启失败，将在下次检查时继续尝试")
-                
-                logger.info(f"✅ 成功重启 {success_count}/{len(failed_ports)} 个端口")
-            else:
-                logger.info("✅ 所有 natter 进程运行正常")
-                
-        except KeyboardInterrupt:
-            break
-        except Exception as e:
-            logger.error(f"❌ 主循环异常: {e}", exc_info=True)
-            # 发生异常时也清理一下进程
-            cleanup_natter_processes()
-            logger.info("⏱️  等待下次检查...")
-            time.sleep(60)
-    
-    # 清理资源
     try:
-        logger.info("")
-        logger.info("⚠️  接收到退出信号，正在清理...")
-        logger.info("🧹 清理资源...")
-        cleanup_natter_processes()
+        # 加载上次运行缓存的 Cloudflare Zone ID 和记录 ID
+        load_cloudflare_cache()
         
-        if frps_process and frps_process.poll() is None:
-            logger.info("🛑 停止 frps 进程...")
-            safe_terminate_process(frps_process, "frps", timeout_terminate=5, timeout_kill=2)
+        # 初始执行一次
+        if not perform_stun_and_update():
+            logger.error("❌ 初始打洞失败，程序退出")
+            sys.exit(1)
         
+        monitor_loop()
+    except KeyboardInterrupt:
         logger.info("")
-        logger.info("="*70)
-        logger.info("👋 服务已停止")
-        logger.info("="*70)
-        logger.info("")
-    except:
-        # 清理过程中忽略所有异常，确保能正常退出
-        pass
+        logger.info("⚠️  接收到退出信号，正在清理...")
+    finally:
+        # 正常退出、收到退出信号、初始打洞失败或异常退出时，都在这里统一停止 natter 和 frps
+        stop_services()
 
 
 if __name__ == '__main__':